@@ -8,7 +8,7 @@ import os
 import ConfigParser
 from sqlalchemy import engine_from_config
 # Import custom modules
-from np.lib import app_globals, helpers, store
+from np.lib import app_globals, helpers, store, dataset_store, curve
 from np.config.routing import make_map
 from np.model import init_model
 
@@ -40,6 +40,9 @@ def load_environment(global_conf, app_conf):
     # Setup the SQLAlchemy database engine
     engine = engine_from_config(config, 'sqlalchemy.')
     init_model(engine)
+    # Configure dataset engines
+    dataset_store.configure(config)
+    curve.configure(config)
     # Load safe
     config['safe'] = loadSafe(config['safe_path'])
     # Return
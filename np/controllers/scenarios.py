@@ -16,7 +16,7 @@ from np import model
 from np.model import Session
 from np.config import parameter
 from np.lib.base import BaseController, render
-from np.lib import helpers as h, metric, network, variable_store, geometry_store, store, smtp
+from np.lib import helpers as h, metric, network, variable_store, geometry_store, dataset_store, store, smtp
 
 
 class ScenariosController(BaseController):
@@ -111,6 +111,9 @@ class ScenariosController(BaseController):
             scenarioScope = model.scopePrivate
         metricModelName = request.POST.get('metricModelName', metric.getModelNames()[0])
         networkModelName = request.POST.get('networkModelName', network.getModelNames()[0])
+        metricEngineName = request.POST.get('metricEngineName', dataset_store.metricEngineNames[0])
+        if metricEngineName not in dataset_store.metricEngineNames:
+            return cjson.encode(dict(isOk=0, message='Unknown metricEngineName: %s' % metricEngineName))
         callbackURL = request.POST.get('callbackURL')
         # Create scenario
         scenario = model.Scenario(personID, scenarioName, scenarioScope)
@@ -128,6 +131,13 @@ class ScenariosController(BaseController):
             demographicFileName = sourceScenario.input['demographic file name']
             demographicPath = os.path.join(scenarioFolder, demographicFileName)
             shutil.copyfile(os.path.join(sourceScenarioFolder, demographicFileName), demographicPath)
+            # Copy the source dataset so that we only recompute what changed
+            sourceDatasetPath = sourceScenario.getDatasetPath()
+            if sourceScenario.status == model.statusDone and os.path.exists(sourceDatasetPath):
+                shutil.copyfile(sourceDatasetPath, os.path.join(scenarioFolder, model.parentDatasetFileName))
+                parentScenarioInput = dict((key, value) for key, value in sourceScenario.input.iteritems() if key != 'parent scenario input')
+            else:
+                parentScenarioInput = None
         # If the user is uploading a new demographicDatabase,
         else:
             # Save original demographicDatabase in case the user wants it later
@@ -137,19 +147,23 @@ class ScenariosController(BaseController):
             demographicPath = os.path.join(scenarioFolder, demographicFileName)
             shutil.copyfileobj(demographicDatabase.file, open(demographicPath, 'wb'))
             demographicDatabase.file.close()
+            parentScenarioInput = None
         # Store input
         configurationByName = extractConfigurationByName(request.POST, scenarioFolder)
         scenario.input = {
             'demographic file name': str(demographicFileName),
             'metric model name': metricModelName,
+            'metric engine name': metricEngineName,
             'metric configuration': configurationByName.get('metric', {}),
             'network model name': networkModelName,
             'network configuration': configurationByName.get('network', {}),
+            'network file digests': model.hashConfigurationFiles(scenarioFolder, network.getModel(networkModelName), configurationByName.get('network', {})),
             'callback url': callbackURL,
             'host url': request.host_url, 
+            'parent scenario input': parentScenarioInput,
         }
         Session.commit()
-        store.zipFolder(scenarioFolder + '.zip', scenarioFolder)
+        model.zipScenarioFolder(scenarioFolder)
         # Redirect
         redirect(url('scenario', id=scenario.id))
 
@@ -204,6 +218,7 @@ class ScenariosController(BaseController):
         c.scenarioInput = c.scenario.input
         c.scenarioOutput = c.scenario.output
         transform_point = geometry_store.get_transform_point(geometry_store.proj4LL, geometry_store.proj4SM)
+        transform_points = geometry_store.get_transform_points(geometry_store.proj4LL, geometry_store.proj4SM)
         # If the user wants HTML,
         if format == 'html':
             # Render scenario
@@ -216,7 +231,7 @@ class ScenariosController(BaseController):
             box2X, box2Y = transform_point(nodeStatistics['maximum longitude'], nodeStatistics['minimum latitude'])
             # Render map
             datasetStore = c.scenario.getDataset()
-            c.mapFeatures = datasetStore.exportGeoJSON(transform_point)
+            c.mapFeatures = datasetStore.exportGeoJSON(transform_points)
             c.mapCenter = '%s, %s' % (centerX, centerY)
             c.mapBox = '%s, %s, %s, %s' % (box1X, box1Y, box2X, box2Y)
             # Render nodes
@@ -229,7 +244,7 @@ class ScenariosController(BaseController):
         elif format == 'zip':
             return forward(FileApp(c.scenario.getFolder() + '.zip'))
         elif format == 'geojson':
-            return c.scenario.getDataset().exportGeoJSON(transform_point)
+            return c.scenario.getDataset().exportGeoJSON(transform_points)
         elif format == 'json':
             return c.scenario.exportJSON(request.params.get('nodeID'))
 
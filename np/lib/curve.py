@@ -6,31 +6,50 @@ import warnings
 import numpy
 import math
 import copy
+import weakref
+import collections
 
 
 def fit(curveType, curvePoints):
-    'Fit the curve'
+    'Fit the curve, keeping recently used curves in a bounded cache'
     # Prepare
     curvePack = curveType, curvePoints
+    curve = curveCache.pop(curvePack, None)
     # If the curve has already been fitted,
-    if curvePack in curveCache:
-        # Return the curve
-        return curveCache[curvePack]
-    # Fit a new curve
-    curveClass = globals()[curveType + 'Curve']
-    curve = curveClass(*curvePoints)
-    # Cache curve for future use
+    if curve is not None:
+        curveCacheCountByName['hits'] += 1
+    # Otherwise,
+    else:
+        curveCacheCountByName['misses'] += 1
+        # Fit a new curve
+        curveClass = globals()[curveType + 'Curve']
+        curve = curveClass(*curvePoints)
+        # Forget the least recently used curve
+        if len(curveCache) >= curveCacheSize:
+            curveCache.popitem(last=False)
+    # Cache curve for future use, marking it as most recently used
     curveCache[curvePack] = curve
     # Return curve
     return curve
 
 
+def getCacheCounts():
+    'Return curve cache hits and misses for the instrumentation in variable_store.VariableProfiler'
+    return dict(curveCacheCountByName)
+
+
 def format(curve):
-    'Return a string representation of the curve'
+    'Return a string representation of the curve, remembering it for each curve instance'
+    # If we have already formatted the curve,
+    if curve in curveTextCache:
+        return curveTextCache[curve]
+    # Format
     curveType = curve.__class__.__name__.replace('Curve', '')
     curveParameters, curveXs = curve.save()
-    curveYs = [curve.interpolate(x) for x in curveXs]
-    return '%s %s; %s' % (curveType, ' '.join(str(x) for x in curveParameters), map(list, itertools.izip(curveXs, curveYs)))
+    curveYs = [curve.interpolate(x, isExact=True) for x in curveXs]
+    curveText = curveTextCache[curve] = '%s %s; %s' % (curveType, ' '.join(str(x) for x in curveParameters), map(list, itertools.izip(curveXs, curveYs)))
+    # Return
+    return curveText
 
 
 def parse(curveString):
@@ -41,9 +60,109 @@ def parse(curveString):
     return curveClass(parameters=curveTerms[1:])
 
 
+def restore(curveType, curveParameters):
+    'Return the shared curve with the given parameters, such as when loading pickled node outputs'
+    # Prepare
+    curvePack = curveType, curveParameters
+    # If we have not loaded the curve yet,
+    if curvePack not in curveByParameters:
+        # Keep the table small in long-running processes
+        if len(curveByParameters) >= curveByParametersSize:
+            curveByParameters.clear()
+        # Load parameters as they are to keep their numeric types
+        curveClass = globals()[curveType + 'Curve']
+        curve = curveByParameters[curvePack] = curveClass.__new__(curveClass)
+        curve.load(list(curveParameters))
+    # Return
+    return curveByParameters[curvePack]
+
+
+def configure(settings):
+    'Load curve settings from the configuration file'
+    global approximationError
+    # Load the maximum error of the lookup table, where an empty value means that we use the exact formula
+    approximationError = float(settings['curve.approximation_error']) if settings.get('curve.approximation_error') else None
+
+
+def interpolateValues(interpolate):
+    'Interpolate arrays at once and use lookup tables if enabled'
+    def interpolateEach(self, x, isExact=False):
+        if isinstance(x, numpy.ndarray):
+            return self.interpolateArray(x)
+        # If we can use a lookup table,
+        if approximationError is not None and not isExact:
+            y = approximate(self, x)
+            if y is not None:
+                return y
+        return interpolate(self, x)
+    interpolateEach.__doc__ = interpolate.__doc__
+    return interpolateEach
+
+
+def approximate(curve, x):
+    'Return the value from the lookup table of the curve or None if we should use the exact formula'
+    # If x is not in the range where tables apply,
+    limitX = curve.getTableLimit()
+    if not 0 < x < limitX:
+        return None
+    table = curve.table
+    # If the curve cannot be tabulated within the maximum error,
+    if table is False:
+        return None
+    # If we do not have a table or x is beyond it,
+    if table is None or x > table.maximumX or table.maximumError != approximationError:
+        # Cover twice the largest value so far to limit the number of rebuilds
+        table = CurveTable(curve, min(2 * max(x, table.maximumX if table else 0), limitX), approximationError)
+        curve.table = table if table.ys else False
+        if not table.ys:
+            return None
+    # Return
+    return table.interpolate(x)
+
+
+class CurveTable(object):
+    'Tabulate a curve on a uniform grid and interpolate piecewise-linearly within a maximum error'
+
+    def __init__(self, curve, maximumX, maximumError):
+        # Initialize
+        self.maximumX = float(maximumX)
+        self.maximumError = maximumError
+        self.ys = None
+        pointCount = tablePointCountMinimum
+        # While the table is small enough,
+        while pointCount <= tablePointCountMaximum:
+            xs = numpy.linspace(0, self.maximumX, pointCount)
+            ys = curve.interpolateArray(xs)
+            # Measure the error inside each interval, skipping the first interval where curves jump from zero
+            errors = [numpy.abs(ys[1:-1] + (ys[2:] - ys[1:-1]) * fraction - curve.interpolateArray(xs[1:-1] + (xs[2:] - xs[1:-1]) * fraction)).max() for fraction in 0.25, 0.5, 0.75]
+            if max(errors) <= maximumError:
+                self.ys = ys.tolist()
+                self.minimumX = xs[1]
+                self.inverseStep = (pointCount - 1) / self.maximumX
+                self.lastIndex = pointCount - 1
+                break
+            # Use a finer grid
+            pointCount = 2 * pointCount - 1
+
+    def interpolate(self, x):
+        'Return the interpolated value or None if x is outside the table'
+        # If x is outside the table,
+        if x < self.minimumX or x > self.maximumX:
+            return None
+        # Find the grid interval
+        position = x * self.inverseStep
+        index = min(int(position), self.lastIndex - 1)
+        y = self.ys[index]
+        # Interpolate
+        return y + (self.ys[index + 1] - y) * (position - index)
+
+
 class Curve(object):
     'Abstract class for fitting curves to points'
 
+    # Keep the lookup table of the curve, where False means that the curve cannot be tabulated
+    table = None
+
     def __init__(self, xs=None, ys=None, parameters=None):
         # If points are defined,
         if xs and ys:
@@ -73,6 +192,14 @@ class Curve(object):
     def save(self):
         pass
 
+    def getTableLimit(self):
+        'Return the value of x below which a lookup table can replace the formula'
+        return 0
+
+    def __reduce__(self):
+        'Pickle the curve by its parameters so that copies in node outputs load as a single shared curve'
+        return restore, (self.__class__.__name__.replace('Curve', ''), tuple(self.save()[0]))
+
 
 class ZeroLinearCurve(Curve):
 
@@ -81,12 +208,19 @@ class ZeroLinearCurve(Curve):
             warnings.simplefilter('ignore')
             self.gradient, self.intercept, self.rValue = scipy.stats.linregress(xs, ys)[:3]
 
+    @interpolateValues
     def interpolate(self, x):
         if x > 0:
             return self.gradient * x + self.intercept
         else:
             return 0
 
+    def interpolateArray(self, xs):
+        ys = numpy.zeros(xs.shape)
+        isPositive = xs > 0
+        ys[isPositive] = self.gradient * xs[isPositive] + self.intercept
+        return ys
+
     def load(self, parameters):
         self.gradient, self.intercept = parameters
 
@@ -129,12 +263,26 @@ class ZeroLogisticCurve(Curve):
         self.baseFactor = math.exp(intercept)
         self.exponentFactor = gradient
 
+    @interpolateValues
     def interpolate(self, x):
         if x > 0:
             return self.lowerBound + (self.upperBound - self.lowerBound) / float(1 + self.baseFactor * numpy.exp(self.exponentFactor * x))
         else:
             return 0
 
+    def interpolateArray(self, xs):
+        ys = numpy.zeros(xs.shape)
+        isPositive = xs > 0
+        ys[isPositive] = self.interpolateLogistic(xs[isPositive])
+        return ys
+
+    def getTableLimit(self):
+        return float('inf')
+
+    def interpolateLogistic(self, xs):
+        'Interpolate positive values using the logistic function'
+        return self.lowerBound + (self.upperBound - self.lowerBound) / (1 + self.baseFactor * numpy.exp(self.exponentFactor * xs))
+
     def load(self, parameters):
         self.upperBound, self.lowerBound, self.baseFactor, self.exponentFactor, self.minimumX, self.maximumX = parameters
 
@@ -154,6 +302,7 @@ class ZeroLogisticLinearCurve(ZeroLogisticCurve):
         # Store relevant parameters
         self.gradient = (ys[-1] - ys[-2]) / float(xs[-1] - xs[-2])
 
+    @interpolateValues
     def interpolate(self, x):
         # If x is not positive,
         if not x > 0:
@@ -168,9 +317,22 @@ class ZeroLogisticLinearCurve(ZeroLogisticCurve):
             # Use linear
             return self.maximumY + self.gradient * (x - self.maximumX)
 
+    def interpolateArray(self, xs):
+        ys = numpy.zeros(xs.shape)
+        isPositive = xs > 0
+        isLogistic = isPositive & (xs < self.maximumX)
+        isLinear = isPositive & ~isLogistic
+        ys[isLogistic] = self.interpolateLogistic(xs[isLogistic])
+        ys[isLinear] = self.maximumY + self.gradient * (xs[isLinear] - self.maximumX)
+        return ys
+
     def load(self, parameters):
         self.upperBound, self.lowerBound, self.baseFactor, self.exponentFactor, self.minimumX, self.maximumX, self.maximumY, self.gradient = parameters
 
+    def getTableLimit(self):
+        # Leave the linear part to the formula
+        return self.maximumX
+
     def save(self):
         return (self.upperBound, self.lowerBound, self.baseFactor, self.exponentFactor, self.minimumX, self.maximumX, self.maximumY, self.gradient), numpy.linspace(0.1, self.maximumX + 0.25 * (self.maximumX - self.minimumX), 100)
 
@@ -178,7 +340,15 @@ class ZeroLogisticLinearCurve(ZeroLogisticCurve):
 
 # Define
 
-curveCache = {}
+curveCache = collections.OrderedDict()
+curveCacheSize = 100
+curveCacheCountByName = {'hits': 0, 'misses': 0}
+curveTextCache = weakref.WeakKeyDictionary()
+curveByParameters = {}
+curveByParametersSize = 100
+approximationError = None
+tablePointCountMinimum = 257
+tablePointCountMaximum = 65537
 curveTypes = sorted([x.replace('Curve', '') for x in dir() if x.endswith('Curve') and x != 'Curve'])
 inputCurveType = """\
 <select id="${key}" name="${key}" class=value>
@@ -2,22 +2,31 @@
 # Import system modules
 import sqlalchemy as sa
 from sqlalchemy import orm
+from sqlalchemy.interfaces import PoolListener
 import re
 import os
+import sys
 import csv
 import math
+import time
 import numpy
 import osgeo.ogr
 import osgeo.osr
 import geojson
+import copy
+import shutil
+import zipfile
+import tempfile
 import itertools
+import threading
+import multiprocessing
 import collections
 import shapely.geometry
 # Import custom modules
-from np.lib import store, geometry_store
+from np.lib import store, geometry_store, metric, network, variable_store
 
 
-def create(targetPath, sourcePath):
+def create(targetPath, sourcePath, pushWarning=None):
     'Import the sourcePath to create the dataset'
     # Initialize
     digestByExtension = {
@@ -31,16 +40,107 @@ def create(targetPath, sourcePath):
     # Import
     proj4, nodePacks = digestByExtension[sourceExtension](sourcePath)
     # Save
-    store.removeSafely(store.replaceFileExtension(targetPath, 'db'))
-    dataset = Store(targetPath, proj4)
-    dataset.addNodes(nodePacks)
+    datasetPath = store.replaceFileExtension(targetPath, 'db')
+    for suffix in '', '-wal', '-shm':
+        store.removeSafely(datasetPath + suffix)
+    forgetCached(datasetPath)
+    dataset = Store(targetPath, proj4, pragmas=runPragmas)
+    dataset.addNodes(nodePacks, pushWarning)
     # Return
     return dataset
 
 
-def load(datasetPath):
+def load(datasetPath, pragmas=None):
     'Load the given dataset'
-    return Store(datasetPath)
+    dataset = Store(datasetPath, pragmas=pragmas)
+    dataset.indexNodeValues()
+    return dataset
+
+
+def loadCached(datasetPath):
+    'Load the given dataset read-only from a process-wide cache of recently used datasets'
+    # Initialize
+    datasetPath = store.replaceFileExtension(datasetPath, 'db')
+    datasetStamp = os.path.getmtime(datasetPath), os.path.getsize(datasetPath)
+    # Look in the cache
+    with datasetCacheLock:
+        datasetPack = datasetCache.pop(datasetPath, None)
+        # If the dataset is cached and has not changed since we opened it,
+        if datasetPack and datasetPack[0] == datasetStamp:
+            # Mark it as most recently used
+            datasetCache[datasetPath] = datasetPack
+            return datasetPack[1]
+    # Release the dataset if it changed
+    if datasetPack:
+        datasetPack[1].close()
+    # Open
+    dataset = Store(datasetPath, isReadOnly=True)
+    # If the dataset predates node_values, fill them once and reopen it
+    if not dataset.hasNodeValues():
+        dataset.close()
+        load(datasetPath).close()
+        dataset = Store(datasetPath, isReadOnly=True)
+        datasetStamp = os.path.getmtime(datasetPath), os.path.getsize(datasetPath)
+    # Store it in the cache
+    with datasetCacheLock:
+        datasetCache[datasetPath] = datasetStamp, dataset
+        # Evict least recently used datasets
+        evictedPacks = []
+        while len(datasetCache) > datasetCacheSize:
+            evictedPacks.append(datasetCache.popitem(last=False)[1])
+    # Release evicted datasets
+    for evictedStamp, evictedDataset in evictedPacks:
+        evictedDataset.close()
+    # Return
+    return dataset
+
+
+def forgetCached(datasetPath):
+    'Remove the given dataset from the cache and release its connections'
+    with datasetCacheLock:
+        datasetPack = datasetCache.pop(store.replaceFileExtension(datasetPath, 'db'), None)
+    if datasetPack:
+        datasetPack[1].close()
+
+
+def configure(settings):
+    'Load dataset settings such as SQLite pragmas from the configuration file'
+    global datasetCacheSize, metricWorkerCount, isMetricProfiled
+    # Load pragmas
+    defaultPragmas[:] = parsePragmas(settings.get('dataset.pragmas', ''))
+    runPragmas[:] = parsePragmas(settings.get('dataset.run_pragmas', ''))
+    # Load cache size
+    datasetCacheSize = int(settings.get('dataset.cache_size', datasetCacheSize))
+    # Load worker count
+    metricWorkerCount = int(settings.get('dataset.metric_worker_count', metricWorkerCount))
+    # Load profiling switch
+    isMetricProfiled = settings.get('dataset.metric_profile', str(isMetricProfiled)).lower() in ['true', 'yes', 'on', '1']
+
+
+def parsePragmas(text):
+    'Parse pragmas such as "journal_mode=WAL synchronous=NORMAL"'
+    pragmaPacks = []
+    # For each term,
+    for term in text.split():
+        match = re.match(r'^(\w+)=(-?\w+)$', term)
+        if not match:
+            raise DatasetError('Could not parse pragma: %s' % term)
+        pragmaPacks.append(match.groups())
+    # Return
+    return pragmaPacks
+
+
+class PragmaListener(PoolListener):
+    'Run PRAGMA statements on each new SQLite connection'
+
+    def __init__(self, pragmaPacks):
+        self.pragmaPacks = pragmaPacks
+
+    def connect(self, dbapi_con, con_record):
+        cursor = dbapi_con.cursor()
+        for name, value in self.pragmaPacks:
+            cursor.execute('PRAGMA %s=%s' % (name, value))
+        cursor.close()
 
 
 class Store(object):
@@ -48,21 +148,37 @@ class Store(object):
 
     debug = False
 
-    def __init__(self, datasetPath, proj4=None):
+    def __init__(self, datasetPath, proj4=None, isReadOnly=False, pragmas=None):
+        # Prepare pragmas
+        pragmaPacks = defaultPragmas + (pragmas or [])
+        if isReadOnly:
+            pragmaPacks = pragmaPacks + [('query_only', 'ON')]
         # Connect
         datasetPath = store.replaceFileExtension(datasetPath, 'db')
-        engine = sa.create_engine('sqlite:///' + datasetPath, echo=self.debug)
-        metadata.create_all(engine)
+        engine = sa.create_engine('sqlite:///' + datasetPath, echo=self.debug, listeners=[PragmaListener(pragmaPacks)])
+        if not isReadOnly:
+            metadata.create_all(engine)
         # Set
-        self.session = orm.sessionmaker(bind=engine)()
+        self.engine = engine
+        self.session = orm.scoped_session(orm.sessionmaker(bind=engine))
         self.datasetPath = datasetPath
+        self.isReadOnly = isReadOnly
         # Set proj4
         if proj4:
             self.session.execute(spatial_references_table.delete())
             self.session.add(SpatialReference(proj4))
             self.session.commit()
         self.proj4 = str(self.session.query(SpatialReference).first().proj4)
-        self.transform_point = geometry_store.get_transform_point(self.proj4)
+        self.transform_points = geometry_store.get_transform_points(self.proj4)
+        self.ingestStatistics = {}
+        self.networkStatistics = {}
+        self.metricStatistics = {}
+        self.connectionsByNodeID = None
+
+    def close(self):
+        'Release the session and database connections'
+        self.session.remove()
+        self.engine.dispose()
 
     def getBasePath(self):
         return os.path.dirname(self.getDatasetPath())
@@ -78,30 +194,84 @@ class Store(object):
 
     def addNode(self, coordinates, nodePack=None, is_fake=False):
         # Compute longitude and latitude
-        longitude, latitude = self.transform_point(*coordinates)
+        longitude, latitude = self.transform_points([coordinates])[0]
         # Add the node
         node = Node(coordinates, (longitude, latitude), nodePack, is_fake)
         self.session.add(node)
         # Return
         return node
 
-    def addNodes(self, nodePacks):
-        # Check for duplicates
-        nodePacksByCoordinates = collections.defaultdict(list)
-        for nodePack in nodePacks:
-            coordinates = float(nodePack['x']), float(nodePack['y'])
-            nodePacksByCoordinates[coordinates].append(nodePack)
-        # For each row,
-        for coordinates, nodePacks in nodePacksByCoordinates.iteritems():
-            # If there are duplicates,
-            if len(nodePacks) > 1:
-                print 'Duplicate nodes' 
-                for nodePack in nodePacks:
-                    print '(%s) %s' % (str(coordinates), nodePack)
-            # Add
-            self.addNode(coordinates, nodePacks[0])
+    def addNodes(self, nodePacks, pushWarning=None):
+        'Stream nodes into the dataset in chunks, then remove duplicates in the database'
+        # Initialize
+        startTimeInSeconds = time.time()
+        # Insert
+        nodeCount = self.insertNodes(((float(x['x']), float(x['y'])), x) for x in nodePacks)
+        # Remove duplicates
+        nodeCount -= self.removeDuplicateNodes(pushWarning)
         # Commit
         self.session.commit()
+        # Record
+        self.recordIngestStatistics(nodeCount, time.time() - startTimeInSeconds)
+        # Return
+        return self.ingestStatistics
+
+    def removeDuplicateNodes(self, pushWarning=None):
+        'Keep only the first real node at each location and return the number of nodes removed'
+        # Initialize
+        if not pushWarning:
+            pushWarning = lambda x: sys.stdout.write(x + '\n')
+        realFilter = nodes_table.c.is_fake==False
+        # Find coordinates that have more than one node
+        duplicateCoordinates = self.session.query(Node.x, Node.y).filter(realFilter).group_by(Node.x, Node.y).having(sa.func.count(Node.id) > 1).all()
+        # If there are no duplicates,
+        if not duplicateCoordinates:
+            return 0
+        # For each location that has duplicates,
+        for x, y in duplicateCoordinates:
+            # Report
+            nodeInputs = [node.input for node in self.session.query(Node).filter(realFilter).filter(Node.x==x).filter(Node.y==y).order_by(Node.id)]
+            pushWarning('Duplicate nodes at (%s, %s): %s' % (x, y, '; '.join(str(nodeInput) for nodeInput in nodeInputs)))
+        # Remove every duplicate except the first
+        keptNodeIDs = sa.select([sa.func.min(nodes_table.c.id)], realFilter).group_by(nodes_table.c.x, nodes_table.c.y)
+        duplicateNodeIDs = sa.select([nodes_table.c.id], realFilter & ~nodes_table.c.id.in_(keptNodeIDs))
+        self.session.execute(node_values_table.delete(node_values_table.c.node_id.in_(duplicateNodeIDs)))
+        # Return
+        return self.session.execute(nodes_table.delete(nodes_table.c.id.in_(duplicateNodeIDs))).rowcount
+
+    def insertNodes(self, nodeItems):
+        'Insert (coordinates, nodePack) pairs in chunks and return the number of nodes inserted'
+        # Initialize
+        nodeItems = iter(nodeItems)
+        nodeID = self.session.query(sa.func.max(Node.id)).scalar() or 0
+        nodeCount = 0
+        # While there are more,
+        while True:
+            nodeItemChunk = list(itertools.islice(nodeItems, nodeChunkSize))
+            if not nodeItemChunk:
+                break
+            # Transform coordinates for the whole chunk at once
+            commonCoordinates = self.transform_points([coordinates for coordinates, nodePack in nodeItemChunk])
+            # Prepare rows with pre-assigned ids so that we can store node values
+            nodeRows, nodeValuePacks = [], []
+            for (coordinates, nodePack), (longitude, latitude) in itertools.izip(nodeItemChunk, commonCoordinates):
+                nodeID += 1
+                nodeRows.append(dict(id=nodeID, x=coordinates[0], y=coordinates[1], longitude=longitude, latitude=latitude, is_fake=False, input=nodePack))
+                nodeValuePacks.extend(yieldNodeInputPacks(nodeID, nodePack))
+            # Insert
+            self.insertRows(nodes_table, nodeRows)
+            self.addNodeValues(nodeValuePacks)
+            nodeCount += len(nodeRows)
+        # Return
+        return nodeCount
+
+    def recordIngestStatistics(self, nodeCount, elapsedTimeInSeconds):
+        'Remember how fast we ingested nodes'
+        self.ingestStatistics = {
+            'ingested node count': nodeCount,
+            'ingest time in seconds': elapsedTimeInSeconds,
+            'ingested nodes per second': nodeCount / elapsedTimeInSeconds if elapsedTimeInSeconds else nodeCount,
+        }
 
     def countNodes(self):
         return self.session.query(Node).filter_by(is_fake=False).count()
@@ -115,7 +285,7 @@ class Store(object):
 
     def getNodeStatistics(self):
         maxLongitude, meanLongitude, minLongitude, maxLatitude, meanLatitude, minLatitude = self.session.query(sa.func.max(Node.longitude), sa.func.avg(Node.longitude), sa.func.min(Node.longitude), sa.func.max(Node.latitude), sa.func.avg(Node.latitude), sa.func.min(Node.latitude)).first()
-        return {
+        nodeStatistics = {
             'node count': self.session.query(Node).filter_by(is_fake=False).count(),
             'maximum longitude': maxLongitude,
             'mean longitude': meanLongitude,
@@ -124,6 +294,10 @@ class Store(object):
             'mean latitude': meanLatitude,
             'minimum latitude': minLatitude,
         }
+        # Include ingest throughput if we created the dataset
+        nodeStatistics.update(self.ingestStatistics)
+        # Return
+        return nodeStatistics
 
     def saveNodesSHP(self, targetPath, isFake=False):
         'Save nodes to a shapefile'
@@ -146,65 +320,267 @@ class Store(object):
 
     # Metric
 
-    def applyMetric(self, metricModel, metricValueByOptionBySection):
-        'Compute a metric for each node'
-        # Load job-level configuration
-        jobVS = metricModel.VariableStore(metricValueByOptionBySection)
-        # For each real node,
-        for node in self.session.query(Node).filter_by(is_fake=False):
-            # Load node-level configuration
-            nodeVS = metricModel.VariableStore(node.getValueByOptionBySection(), jobVS)
+    def applyMetric(self, metricModel, metricValueByOptionBySection, workerCount=None, metricEngineName=None, profiler=None):
+        'Compute a metric for each node, optionally using a pool of worker processes'
+        # Load job-level configuration and compute variables that no node overrides
+        jobVS = self.prepareMetricJob(metricModel, metricValueByOptionBySection, metricEngineName, profiler)
+        # Profile in this process so that the profiler sees every node
+        workerCount = 1 if profiler else workerCount or metricWorkerCount
+        # Split node ids into chunks
+        nodeIDs = [x[0] for x in self.session.query(Node.id).filter(Node.is_fake==False).order_by(Node.id)]
+        nodeIDChunks = [nodeIDs[x:x + metricChunkSize] for x in xrange(0, len(nodeIDs), metricChunkSize)]
+        # If we have more than one worker,
+        if workerCount > 1 and len(nodeIDChunks) > 1:
+            # Let workers read committed inputs while we write in write-ahead log mode
+            self.session.commit()
+            journalMode = self.setJournalMode('wal')
+            # Let each worker load the dataset and job-level configuration once
+            pool = multiprocessing.Pool(workerCount, initializeMetricWorker, (self.getDatasetPath(), metricModel.__name__, metricValueByOptionBySection, metricEngineName))
+            resultChunks = pool.imap(evaluateMetricChunk, nodeIDChunks)
+        # If we have only one worker,
+        else:
+            pool = None
+            resultChunks = (evaluateNodeMetrics(self, metricModel, jobVS, x) for x in nodeIDChunks)
+        try:
+            # Save results as they arrive
+            for resultChunk in resultChunks:
+                self.saveNodeMetrics(resultChunk)
+            # Remove old outputs once we have every result
+            self.session.execute(node_values_table.delete().where(node_values_table.c.section!=''))
+            # Commit
+            self.session.commit()
+        finally:
+            # Clean up
+            if pool:
+                pool.terminate()
+                pool.join()
+                self.session.rollback()
+                self.setJournalMode(journalMode)
+        # Return outputs
+        return jobVS.getValueByOptionBySection()
+
+    def setJournalMode(self, journalMode):
+        'Set the SQLite journal mode outside a transaction and return the previous mode'
+        previousJournalMode = self.session.execute('PRAGMA journal_mode').scalar()
+        self.session.execute('PRAGMA journal_mode=%s' % journalMode)
+        self.session.commit()
+        return previousJournalMode
+
+    def reapplyMetric(self, metricModel, metricValueByOptionBySection, parentMetricValueByOptionBySection, metricEngineName=None, profiler=None):
+        'Recompute only the variables affected by configuration changes and return outputs and whether any metric changed'
+        # Load job-level configuration and compute variables that no node overrides
+        jobVS = self.prepareMetricJob(metricModel, metricValueByOptionBySection, metricEngineName, profiler)
+        # Find variables affected by the configuration changes, where system depends on the network
+        changedClasses = variable_store.getChangedVariableClasses(metricModel.VariableStore, metricValueByOptionBySection, parentMetricValueByOptionBySection)
+        affectedClasses = variable_store.getAffectedVariableClasses(metricModel.VariableStore, changedClasses.union([metricModel.System]))
+        affectedKeys = set((x.section, x.option) for x in affectedClasses)
+        isMetricAffected = metricModel.Metric in affectedClasses
+        self.metricStatistics.update({
+            'changed parameter count': len(changedClasses),
+            'recomputed variable count': len(affectedClasses),
+        })
+        # Split node ids into chunks
+        nodeIDs = [x[0] for x in self.session.query(Node.id).filter(Node.is_fake==False).order_by(Node.id)]
+        nodeIDChunks = [nodeIDs[x:x + metricChunkSize] for x in xrange(0, len(nodeIDs), metricChunkSize)]
+        # Remove old outputs
+        self.session.execute(node_values_table.delete().where(node_values_table.c.section!=''))
+        isMetricChanged = False
+        # For each chunk,
+        for nodeIDChunk in nodeIDChunks:
+            metricPacks = []
+            # For each node,
+            for nodeID, nodeMetric, nodeInput, nodeOutput in self.session.query(Node.id, Node.metric, Node.input, Node.output).filter(Node.id.in_(nodeIDChunk)).order_by(Node.id):
+                # Keep stored outputs that are not affected
+                valueByOptionBySection = collections.defaultdict(dict)
+                for section, valueByOption in (nodeOutput or {}).iteritems():
+                    valueByOptionBySection[section].update((option, value) for option, value in valueByOption.iteritems() if (section, option) not in affectedKeys)
+                # Restore node-level overrides
+                for section, value in parseNodeInput(nodeInput).iteritems():
+                    if isinstance(value, dict):
+                        valueByOptionBySection[section].update(value)
+                    else:
+                        valueByOptionBySection[section] = value
+                # Recompute affected variables
+                nodeVS = jobVS.makeChild(valueByOptionBySection, isTyped=True)
+                # If the metric is affected,
+                if isMetricAffected:
+                    newMetric = nodeVS.get(metricModel.Metric)
+                    isMetricChanged = isMetricChanged or newMetric != nodeMetric
+                    nodeMetric = newMetric
+                metricPacks.append((nodeID, nodeMetric, nodeVS.getTypedValueByOptionBySection()))
             # Save results
-            node.metric = nodeVS.get(metricModel.Metric)
-            node.output = nodeVS.getValueByOptionBySection()
+            self.saveNodeMetrics(metricPacks)
         # Commit
         self.session.commit()
         # Return outputs
-        return jobVS.getValueByOptionBySection()
+        return jobVS.getValueByOptionBySection(), isMetricChanged
+
+    def prepareMetricJob(self, metricModel, metricValueByOptionBySection, metricEngineName=None, profiler=None):
+        'Load job-level configuration, hoist node-invariant variables and record how many we hoisted'
+        jobVS = makeMetricJob(metricModel, metricValueByOptionBySection, metricEngineName, profiler)
+        self.metricStatistics = {
+            'hoisted variable count': len(self.hoistMetricVariables(metricModel, jobVS)),
+        }
+        return jobVS
+
+    def hoistMetricVariables(self, metricModel, jobVS):
+        'Compute variables that do not depend on node-level overrides once in the job-level store and return them'
+        # Find variables that the dataset can override using the input column headers
+        nodeHeaders = [x[0] for x in self.session.query(node_values_table.c.option).filter(node_values_table.c.section=='').distinct()]
+        overridableClasses = [x[0] for x in metricModel.VariableStore.extractVariableValues(parseNodeInput(dict.fromkeys(nodeHeaders, '')))]
+        # Hoist the others
+        return jobVS.hoistVariables(variable_store.getInvariantVariableClasses(metricModel.VariableStore, overridableClasses))
+
+    def sweepMetric(self, metricModel, metricValueByOptionBySection, parameter, values, networkModel=None, networkValueByOptionBySection=None, workerCount=None):
+        'Recompute system counts and totals for each value of a parameter and return (headers, rows), where each value copies the whole dataset file'
+        # Make sure that the parameter is a variable of the metric model
+        if not metricModel.VariableStore.extractVariableValues(parseNodeInput({parameter: ''})):
+            raise DatasetError('Parameter %s is not in metric model %s' % (parameter, metricModel.__name__))
+        # Make sure that node outputs come from the base configuration
+        self.checkMetricConfiguration(metricModel, metricValueByOptionBySection)
+        # Prepare a sweep point for each value
+        self.session.commit()
+        sweepPacks = [(self.getDatasetPath(), metricModel.__name__, metricValueByOptionBySection, parameter, x, networkModel.__name__ if networkModel else None, networkValueByOptionBySection) for x in values]
+        workerCount = workerCount or metricWorkerCount
+        # If we have more than one worker,
+        if workerCount > 1 and len(sweepPacks) > 1:
+            pool = multiprocessing.Pool(min(workerCount, len(sweepPacks)))
+            sweepRows = pool.map(evaluateSweepPoint, sweepPacks)
+            pool.close()
+            pool.join()
+        # If we have only one worker,
+        else:
+            sweepRows = map(evaluateSweepPoint, sweepPacks)
+        # Arrange counts for every system that any sweep point chose
+        systems = sorted(set(itertools.chain(*(x[1] for x in sweepRows))))
+        totalClasses = metricModel.VariableStore.aggregateClasses + metricModel.VariableStore.summaryClasses
+        sweepHeaders = [parameter] + ['%s count' % x for x in systems] + ['%s > %s' % (x.section, x.option) for x in totalClasses]
+        # Return
+        return sweepHeaders, [[value] + [countBySystem.get(x, 0) for x in systems] + totals for value, countBySystem, totals in sweepRows]
+
+    def checkMetricConfiguration(self, metricModel, metricValueByOptionBySection):
+        'Raise DatasetError unless node outputs come from updateMetric with the given configuration'
+        # Load the first real node
+        nodePack = self.session.query(Node.input, Node.output).filter(Node.is_fake==False).order_by(Node.id).first()
+        if not nodePack:
+            return
+        nodeInput, nodeOutput = nodePack
+        nodeOutput = nodeOutput or {}
+        # Make sure that we chose systems using the network
+        if metricModel.System.option not in nodeOutput.get(metricModel.System.section, {}):
+            raise DatasetError('Apply the metric, build the network and update the metric before sweeping')
+        # Make sure that stored values match configured values unless the node overrides them
+        overriddenClasses = set(x[0] for x in metricModel.VariableStore.extractVariableValues(parseNodeInput(nodeInput)))
+        for variableClass, variable in metricModel.VariableStore(metricValueByOptionBySection).variableByClass.iteritems():
+            if variableClass in overriddenClasses:
+                continue
+            valueByOption = nodeOutput.get(variableClass.section, {})
+            if variableClass.option in valueByOption and valueByOption[variableClass.option] != variable.value:
+                raise DatasetError('Node outputs were computed with a different value for %s > %s' % (variableClass.section, variableClass.option))
+
+    def getNodeInputs(self, nodeIDs):
+        'Return (nodeID, nodeInput) pairs for the given nodes'
+        return self.session.query(Node.id, Node.input).filter(Node.id.in_(nodeIDs)).order_by(Node.id).all()
+
+    def saveNodeMetrics(self, metricPacks):
+        'Save (nodeID, metric, typed output) results using executemany, leaving node_values to updateMetric'
+        # If there are no results,
+        if not metricPacks:
+            return
+        # Update nodes
+        self.session.execute(nodes_table.update().where(nodes_table.c.id==sa.bindparam('nodeID')).values(
+            metric=sa.bindparam('nodeMetric', type_=nodes_table.c.metric.type),
+            output=sa.bindparam('nodeOutput', type_=nodes_table.c.output.type),
+        ), [dict(nodeID=nodeID, nodeMetric=nodeMetric, nodeOutput=nodeOutput) for nodeID, nodeMetric, nodeOutput in metricPacks])
 
     def getMetricStatistics(self):
         'Compute metric statistics'
-        # Prepare metrics
-        metrics = [x[0] for x in self.session.query(Node.metric).filter_by(is_fake=False)]
-        # Aggregate
-        populations = []
+        # Aggregate metrics
+        minimumMetric, maximumMetric, meanMetric = self.session.query(sa.func.min(Node.metric), sa.func.max(Node.metric), sa.func.avg(Node.metric)).filter(Node.is_fake==False).first()
+        # Aggregate systems
         countBySystem = collections.defaultdict(int)
-        for node in self.cycleNodes():
-            nodeOutput = node.output
-            countBySystem[nodeOutput['metric']['system']] += 1
-            populations.append(int(nodeOutput['demographics']['population count']))
+        countBySystem.update(self.getNodeValueQuery('metric', 'system', node_values_table.c.text, sa.func.count(node_values_table.c.node_id)).group_by(node_values_table.c.text))
+        # Scan populations
+        populations = [int(x[0]) for x in self.getNodeValueQuery('demographics', 'population count', node_values_table.c.number)]
         # Process
         populations1, populations2 = store.splitList(populations, 2)
-        # Return
-        return {
-            'minimum metric': min(metrics),
-            'maximum metric': max(metrics),
-            'mean metric': numpy.mean(metrics),
+        metricStatistics = {
+            'minimum metric': minimumMetric,
+            'maximum metric': maximumMetric,
+            'mean metric': meanMetric,
             'count by system': countBySystem,
             'population quartiles': [numpy.median(populations1), numpy.median(populations), numpy.median(populations2)],
         }
+        # Include hoisting and recomputation counts if we computed the metric
+        metricStatistics.update(self.metricStatistics)
+        # Return
+        return metricStatistics
 
     def saveMetricsCSV(self, targetPath, metricModel):
         'Save node-level metrics in CSV format'
         # Make sure that nodes exist
         if not self.countNodes():
             return
-        # Prepare column headers in order
-        node = self.cycleNodes().next()
-        nodeInput = node.input
-        nodeOutput = node.output
-        headerPacks = [('', key) for key in sorted(nodeInput)]
-        for section, valueByOption in sorted(nodeOutput.iteritems(), key=lambda x: metricModel.sections.index(x[0])):
-            for option in sorted(valueByOption):
-                headerPacks.append((section, option))
+        # Prepare column headers in order, where inputs have an empty section
+        getSectionIndex = lambda section: metricModel.sections.index(section) if section else -1
+        headerPacks = sorted(self.session.query(node_values_table.c.section, node_values_table.c.option).distinct(), key=lambda x: (getSectionIndex(x[0]), x[1]))
         # Prepare
         csvWriter = csv.writer(open(store.replaceFileExtension(targetPath, 'csv'), 'wb'))
         csvWriter.writerow(['PROJ.4 ' + self.getProj4()])
         csvWriter.writerow(['%s > %s' % (section.capitalize(), option.capitalize()) if section else option.capitalize() for section, option in headerPacks])
+        # Scan node values ordered by node
+        nodeValueQuery = self.session.query(node_values_table.c.node_id, node_values_table.c.section, node_values_table.c.option, node_values_table.c.text).order_by(node_values_table.c.node_id)
         # For each node,
-        for node in self.cycleNodes():
+        for nodeID, nodeValuePacks in itertools.groupby(nodeValueQuery, lambda x: x[0]):
             # Write row
-            csvWriter.writerow([node.output.get(section, {}).get(option, '') if section else node.input.get(option, '') for section, option in headerPacks])
+            textByHeader = dict(((section, option), text) for nodeID, section, option, text in nodeValuePacks)
+            csvWriter.writerow([textByHeader.get(x, u'').encode('utf-8') for x in headerPacks])
+
+    # Node values
+
+    def getNodeValueQuery(self, section, option, *columns):
+        'Return SQLAlchemy query over the given node_values columns for a single variable'
+        return self.session.query(*columns).filter(node_values_table.c.section==section).filter(node_values_table.c.option==option)
+
+    def addNodeValues(self, nodeValuePacks):
+        'Insert node values in chunks'
+        self.insertRows(node_values_table, nodeValuePacks)
+
+    def insertRows(self, table, rows):
+        'Insert rows in chunks using executemany'
+        # Prepare
+        rows = iter(rows)
+        insert = table.insert()
+        # While there are more,
+        while True:
+            rowChunk = list(itertools.islice(rows, rowChunkSize))
+            if not rowChunk:
+                break
+            self.session.execute(insert, rowChunk)
+
+    def replaceNodeOutputValues(self, nodeValuePacks):
+        'Replace stored node outputs while keeping node inputs'
+        self.session.execute(node_values_table.delete().where(node_values_table.c.section!=''))
+        self.addNodeValues(nodeValuePacks)
+
+    def hasNodeValues(self):
+        'Return True if node_values exists and is filled or if there are no nodes to fill it with'
+        if not self.engine.has_table(node_values_table.name):
+            return False
+        return bool(self.session.query(node_values_table.c.node_id).first() or not self.countNodes())
+
+    def indexNodeValues(self):
+        'Fill node_values from the pickled dictionaries of datasets created before the table existed'
+        # If node values are already indexed or there are no nodes,
+        if self.hasNodeValues():
+            return
+        # For each real node,
+        for node in self.cycleNodes():
+            # Store inputs and outputs
+            self.addNodeValues(yieldNodeInputPacks(node.id, node.input or {}))
+            self.addNodeValues(yieldNodeOutputPacks(node.id, node.output or {}))
+        # Commit
+        self.session.commit()
 
     # Network
 
@@ -214,32 +590,56 @@ class Store(object):
         jobVS = networkModel.VariableStore(networkValueByOptionBySection, state=[self])
         # Build network
         net = jobVS.buildNetworkFromNodes(list(self.cycleNodes()), self.getProj4())
+        # Save network
+        startTimeInSeconds = time.time()
+        self.saveNetwork(net)
+        self.networkStatistics = {
+            'network persistence time in seconds': time.time() - startTimeInSeconds,
+        }
+        # Index connections for updateMetric
+        self.indexConnections()
+        # Return outputs
+        return jobVS.getValueByOptionBySection()
+
+    def removeNetwork(self):
+        'Remove segments, subnets and fake nodes so that the network can be rebuilt'
+        self.session.execute(segments_table.delete())
+        self.session.execute(subnets_table.delete())
+        self.session.execute(nodes_table.delete().where(nodes_table.c.is_fake==True))
+        self.session.commit()
+        self.connectionsByNodeID = None
+
+    def saveNetwork(self, net):
+        'Save fake nodes, subnets and segments in a single transaction using pre-assigned ids'
+        # Initialize
+        nodeID = self.session.query(sa.func.max(Node.id)).scalar() or 0
+        subnetID = self.session.query(sa.func.max(Subnet.id)).scalar() or 0
+        nodeRows, subnetRows, segmentRows = [], [], []
         # For each subnet in the generated network,
         for networkSubnet in net.cycleSubnets():
             # Create the subnet in our dataset
-            datasetSubnet = Subnet()
-            self.session.add(datasetSubnet)
-            self.session.commit()
+            subnetID += 1
+            subnetRows.append(dict(id=subnetID))
             # For each segment in the subnetwork,
             for networkSegment in networkSubnet.cycleSegments():
                 # Save fake nodes if we have any
                 for networkNode in (x for x in networkSegment.getNodes() if x.getID() < 0):
                     # Create the fake node in our dataset
-                    datasetNode = self.addNode(networkNode.getCoordinates(), is_fake=True)
-                    self.session.add(datasetNode)
-                    self.session.commit()
+                    nodeID += 1
+                    x, y = networkNode.getCoordinates()
+                    longitude, latitude = networkNode.getCommonCoordinates()
+                    nodeRows.append(dict(id=nodeID, x=x, y=y, longitude=longitude, latitude=latitude, is_fake=True))
                     # Store the id
-                    networkNode.setID(datasetNode.id)
+                    networkNode.setID(nodeID)
                 # Add segment
-                segment = Segment(*networkSegment.getSortedNodeIDs())
-                segment.subnet_id = datasetSubnet.id
-                segment.is_existing = networkSegment.is_existing
-                segment.weight = networkSegment.getWeight()
-                self.session.add(segment)
+                node1ID, node2ID = networkSegment.getSortedNodeIDs()
+                segmentRows.append(dict(node1_id=node1ID, node2_id=node2ID, subnet_id=subnetID, is_existing=networkSegment.is_existing, weight=networkSegment.getWeight()))
+        # Insert
+        self.insertRows(nodes_table, nodeRows)
+        self.insertRows(subnets_table, subnetRows)
+        self.insertRows(segments_table, segmentRows)
         # Commit
         self.session.commit()
-        # Return outputs
-        return jobVS.getValueByOptionBySection()
 
     # Segment
 
@@ -270,16 +670,33 @@ class Store(object):
         for subnet in self.session.query(Subnet):
             yield subnet
 
+    def indexConnections(self):
+        'Load segments into memory by node id so that connection lookups do not need a database round trip'
+        self.connectionsByNodeID = {}
+        # For each segment,
+        for connection in self.session.query(segments_table.c.node1_id, segments_table.c.node2_id, segments_table.c.subnet_id, segments_table.c.is_existing, segments_table.c.weight):
+            # Register the connection with both nodes
+            self.connectionsByNodeID.setdefault(connection.node1_id, []).append(connection)
+            self.connectionsByNodeID.setdefault(connection.node2_id, []).append(connection)
+        # Return
+        return self.connectionsByNodeID
+
+    def getConnections(self, node):
+        'Return connections to the node from the in-memory index'
+        connectionsByNodeID = self.connectionsByNodeID if self.connectionsByNodeID is not None else self.indexConnections()
+        return connectionsByNodeID.get(node.id, [])
+
     def cycleConnections(self, node, is_existing=None):
         'Cycle through segments connected to the node'
-        for connection in self.getSegmentQuery(is_existing).filter((Segment.node1_id==node.id) | (Segment.node2_id==node.id)):
-            yield connection
+        for connection in self.getConnections(node):
+            if is_existing == None or connection.is_existing == is_existing:
+                yield connection
 
     def isNodeConnected(self, node):
-        return True if self.session.query(Segment).filter((Segment.node1_id==node.id) | (Segment.node2_id==node.id)).first() else False
+        return True if self.getConnections(node) else False
 
     def wasNodeAlreadyConnected(self, node):
-        return True if self.session.query(Segment).filter(Segment.is_existing==True).filter((Segment.node1_id==node.id) | (Segment.node2_id==node.id)).first() else False
+        return True if any(x.is_existing for x in self.getConnections(node)) else False
 
     def sumNetworkWeight(self, is_existing=None):
         'Get the weight of the network, where weight corresponds to length in most cases'
@@ -295,11 +712,15 @@ class Store(object):
         return value if value else 0
 
     def getNetworkStatistics(self):
-        return {
+        networkStatistics = {
             'segment count': self.session.query(Segment).count(),
             'new segment weight': self.sumNetworkWeight(is_existing=False),
             'old segment weight':  self.sumNetworkWeight(is_existing=True),
         }
+        # Include persistence time if we built the network
+        networkStatistics.update(self.networkStatistics)
+        # Return
+        return networkStatistics
 
     def saveSegmentsSHP(self, targetPath, is_existing=None):
         # If there are no segments,
@@ -318,49 +739,63 @@ class Store(object):
 
     # Output
 
-    def updateMetric(self, metricModel, metricValueByOptionBySection):
+    def updateMetric(self, metricModel, metricValueByOptionBySection, profiler=None):
         'Add outputs that can only be determined after we have both the metric and network'
         # Load job-level configuration
-        jobVS = metricModel.VariableStore(metricValueByOptionBySection, state=[self])
+        variableStoreClass = profiler.wrap(metricModel.VariableStore) if profiler else metricModel.VariableStore
+        jobVS = variableStoreClass(metricValueByOptionBySection, state=[self])
         jobVS.initializeAggregates()
+        nodeValuePacks = []
         # For each real node,
         for node in self.session.query(Node).filter_by(is_fake=False):
             # Restore node-level configuration
-            nodeVS = metricModel.VariableStore(node.output, state=[self, node])
+            nodeVS = variableStoreClass(node.output, state=[self, node], isTyped=True)
             # Compute more
             nodeVS.get(metricModel.System)
             jobVS.updateAggregates(nodeVS)
-            # Set output
-            node.output = nodeVS.getValueByOptionBySection()
+            # Set output, formatting values only for the node_values columns
+            node.output = nodeVS.getTypedValueByOptionBySection()
+            nodeValuePacks.extend(yieldNodeOutputPacks(node.id, variable_store.formatValueByOptionBySection(metricModel.VariableStore, node.output)))
         # Compute summary variables
         jobVS.processAggregates()
+        # Store outputs as columns
+        self.replaceNodeOutputValues(nodeValuePacks)
         # Commit
         self.session.commit()
         # Return
         return jobVS.getValueByOptionBySection()
     
-    def exportGeoJSON(self, transform_point=None):
+    def exportGeoJSON(self, transform_points=None):
         # Initialize features as a list
         features = []
+        if not transform_points:
+            transform_points = geometry_store.get_transform_points(geometry_store.proj4LL, geometry_store.proj4LL)
+        # Scan the columns we need
+        populationByNodeID = dict(self.getNodeValueQuery('demographics', 'population count', node_values_table.c.node_id, node_values_table.c.text))
+        systemByNodeID = dict(self.getNodeValueQuery('metric', 'system', node_values_table.c.node_id, node_values_table.c.text))
+        # Transform node coordinates in a single call
+        nodes = list(self.cycleNodes())
+        nodeCoordinates = transform_points([x.getCommonCoordinates() for x in nodes]).tolist()
         # For each node,
-        for node in self.cycleNodes():
-            # Load node
-            nodeOutput = node.output
+        for node, coordinates in itertools.izip(nodes, nodeCoordinates):
             # Append a geojson feature using the node's id and other desired properties
             features.append(geojson.Feature(
                 id='n%s' % node.id, 
-                geometry=node.exportGeoJSONGeometry(transform_point), 
+                geometry=geojson.Point(coordinates), 
                 properties={
-                    'population': nodeOutput['demographics']['population count'],
-                    'system': nodeOutput['metric']['system'],
+                    'population': populationByNodeID.get(node.id),
+                    'system': systemByNodeID.get(node.id),
                 },
             ))
+        # Transform segment coordinates in a single call
+        segments = list(self.cycleSegments())
+        segmentCoordinates = transform_points([y for x in segments for y in x.getCommonCoordinates()]).reshape(-1, 2, 2).tolist()
         # For each segment,
-        for segment in self.cycleSegments():
+        for segment, coordinates in itertools.izip(segments, segmentCoordinates):
             # Append a geojson feature using the segment's id and other desired properties
             features.append(geojson.Feature(
                 id='s%s-%s' % (segment.node1_id, segment.node2_id), 
-                geometry=segment.exportGeoJSONGeometry(transform_point),
+                geometry=geojson.LineString(coordinates),
                 properties={
                     'subnet_id': segment.subnet_id,
                     'is_existing': 1 if segment.is_existing else 0,
@@ -400,42 +835,205 @@ def digestNodesFromCSV(sourcePath):
     # Check whether we do in fact have labels
     if not set(labels).intersection(['name', 'x', 'y']):
         raise DatasetError('Expected spatial reference or labels but found this instead: %s' % labels)
-    # Prepare nodePacks
-    nodePacks = [dict(itertools.izip(labels, values)) for values in rowGenerator]
-    ignoreNodesWithMissingCoordinates = lambda x: x['x'] != '' and x['y'] != ''
     # Return
-    return proj4, filter(ignoreNodesWithMissingCoordinates, nodePacks)
+    return proj4, yieldNodePacksFromCSV(rowGenerator, labels)
+
+def yieldNodePacksFromCSV(rowGenerator, labels):
+    'Generate nodePacks one row at a time, ignoring nodes with missing coordinates'
+    for values in rowGenerator:
+        nodePack = dict(itertools.izip(labels, values))
+        if nodePack['x'] != '' and nodePack['y'] != '':
+            yield nodePack
 
 def digestNodesFromSHP(sourcePath):
     'Import nodes from a shapefile'
     # Initialize
     shapeData = osgeo.ogr.Open(sourcePath)
+    if not shapeData:
+        raise DatasetError('Could not open shapefile')
     layer = shapeData.GetLayer()
     # Prepare spatial reference
     proj4 = layer.GetSpatialRef().ExportToProj4()
-    # Prepare nodePacks
-    nodePacks = []
-    for featureIndex in xrange(layer.GetFeatureCount()):
+    # Return
+    return proj4, yieldNodePacksFromSHP(shapeData, layer)
+
+def yieldNodePacksFromSHP(shapeData, layer):
+    'Generate nodePacks one feature at a time; keep a reference to shapeData so that the layer stays valid'
+    # Start from the first feature
+    layer.ResetReading()
+    feature = layer.GetNextFeature()
+    # While there are more,
+    while feature:
         # Get feature
-        feature = layer.GetFeature(featureIndex)
         geometry = feature.GetGeometryRef()
-        # Build nodePack
-        valueByLabel = feature.items()
-        nodePack = dict((label.lower(), value) for label, value in valueByLabel.iteritems() if value not in ['', None])
-        nodePack['x'] = geometry.GetX()
-        nodePack['y'] = geometry.GetY()
-        # Append
-        nodePacks.append(nodePack)
-    # Return
-    return proj4, nodePacks
+        # If the feature has coordinates,
+        if geometry:
+            # Build nodePack
+            valueByLabel = feature.items()
+            nodePack = dict((label.lower(), value) for label, value in valueByLabel.iteritems() if value not in ['', None])
+            nodePack['x'] = geometry.GetX()
+            nodePack['y'] = geometry.GetY()
+            # Yield
+            yield nodePack
+        # Get the next feature
+        feature = layer.GetNextFeature()
 
 def digestNodesFromZIP(sourcePath):
-    # Shape
-    hasShapeFile, shapePath = store.unzip(sourcePath, '.shp')
-    if not hasShapeFile:
+    'Import nodes from a shapefile inside an archive without extracting it'
+    # Find shapefile
+    sourceZip = zipfile.ZipFile(sourcePath)
+    shapeNames = [x for x in sourceZip.namelist() if os.path.splitext(x)[1].lower() == '.shp']
+    sourceZip.close()
+    if not shapeNames:
         raise DatasetError('Archive does not contain a shapefile')
-    # Digest
-    return digestNodesFromSHP(shapePath)
+    # Digest in place using GDAL's virtual filesystem
+    return digestNodesFromSHP('/vsizip/%s/%s' % (os.path.abspath(sourcePath), shapeNames[0]))
+
+
+# Metric
+
+metricChunkSize = 1000
+metricWorkerCount = 1
+isMetricProfiled = False
+metricWorkerState = {}
+metricEngineNames = ['store', 'evaluator']
+pattern_override = re.compile(r'(.*?)\s*>\s*(.*)')
+
+def makeMetricJob(metricModel, metricValueByOptionBySection, metricEngineName=None, profiler=None):
+    'Load job-level configuration using the given metric engine'
+    # If the engine is unknown,
+    if metricEngineName and metricEngineName not in metricEngineNames:
+        raise DatasetError('Metric engine %s is not available' % metricEngineName)
+    # If we want the evaluator that does not create Variable instances,
+    if metricEngineName == 'evaluator':
+        return variable_store.VariableEvaluator(metricModel.VariableStore, metricValueByOptionBySection)
+    # Return, where only VariableStore reports to the profiler
+    return (profiler.wrap(metricModel.VariableStore) if profiler else metricModel.VariableStore)(metricValueByOptionBySection)
+
+def evaluateNodeMetrics(dataset, metricModel, jobVS, nodeIDs):
+    'Evaluate the metric model for the given nodes and return (nodeID, metric, output) for each'
+    metricPacks = []
+    # For each node,
+    for nodeID, nodeInput in dataset.getNodeInputs(nodeIDs):
+        # Load node-level configuration
+        nodeVS = jobVS.makeChild(parseNodeInput(nodeInput))
+        # Save results
+        metricPacks.append((nodeID, nodeVS.get(metricModel.Metric), nodeVS.getTypedValueByOptionBySection()))
+    # Return
+    return metricPacks
+
+def initializeMetricWorker(datasetPath, metricModelName, metricValueByOptionBySection, metricEngineName=None):
+    'Load the dataset and job-level configuration once per worker process'
+    metricModel = metric.getModel(metricModelName)
+    metricWorkerState['dataset'] = dataset = Store(datasetPath, isReadOnly=True)
+    metricWorkerState['metricModel'] = metricModel
+    metricWorkerState['jobVS'] = dataset.prepareMetricJob(metricModel, metricValueByOptionBySection, metricEngineName)
+
+def evaluateMetricChunk(nodeIDs):
+    'Evaluate a chunk of nodes inside a worker process'
+    return evaluateNodeMetrics(metricWorkerState['dataset'], metricWorkerState['metricModel'], metricWorkerState['jobVS'], nodeIDs)
+
+def evaluateSweepPoint(sweepPack):
+    'Evaluate a single parameter value on a temporary copy of the dataset and return (value, countBySystem, totals)'
+    # Unpack
+    datasetPath, metricModelName, baseValueByOptionBySection, parameter, value, networkModelName, networkValueByOptionBySection = sweepPack
+    metricModel = metric.getModel(metricModelName)
+    # Copy the dataset so that each sweep point can replace node outputs and the network
+    temporaryFolder = tempfile.mkdtemp(dir=os.path.dirname(datasetPath))
+    dataset = None
+    try:
+        temporaryPath = os.path.join(temporaryFolder, os.path.basename(datasetPath))
+        shutil.copy(datasetPath, temporaryPath)
+        dataset = Store(temporaryPath, pragmas=runPragmas)
+        # Recompute only the variables affected by the parameter
+        metricValueByOptionBySection = copy.deepcopy(baseValueByOptionBySection)
+        for section, parameterValue in parseNodeInput({parameter: value}).iteritems():
+            if isinstance(parameterValue, dict):
+                metricValueByOptionBySection.setdefault(section, {}).update(parameterValue)
+            else:
+                metricValueByOptionBySection[section] = parameterValue
+        metricValueByOptionBySection, isMetricChanged = dataset.reapplyMetric(metricModel, metricValueByOptionBySection, baseValueByOptionBySection)
+        # If the metric changed, rebuild the network
+        if isMetricChanged:
+            if not networkModelName:
+                raise DatasetError('%s = %s changes the metric, so the sweep needs a network model' % (parameter, value))
+            dataset.removeNetwork()
+            dataset.buildNetwork(network.getModel(networkModelName), networkValueByOptionBySection)
+        # Choose systems and compute totals
+        metricValueByOptionBySection = dataset.updateMetric(metricModel, metricValueByOptionBySection)
+        countBySystem = dataset.getMetricStatistics()['count by system']
+    finally:
+        # Release the connection before removing the file, even if the sweep point failed
+        if dataset:
+            dataset.close()
+        shutil.rmtree(temporaryFolder, ignore_errors=True)
+    # Return
+    return value, dict(countBySystem), [float(metricValueByOptionBySection[x.section][x.option]) for x in metricModel.VariableStore.aggregateClasses + metricModel.VariableStore.summaryClasses]
+
+def parseNodeInput(nodeInput):
+    'Arrange node attributes by section, treating attributes of the form "section > option" as node-level overrides'
+    # Initialize
+    valueByOptionBySection = collections.defaultdict(dict)
+    # For each attribute,
+    for name, value in nodeInput.iteritems():
+        # Check whether the attribute is a node-level override
+        match = pattern_override.match(name)
+        # If the attribute is a node-level override,
+        if match:
+            # Get section and option
+            section, option = match.groups()
+            # Store it
+            valueByOptionBySection[section][option] = value
+        else:
+            # Store it in case it is an alias
+            valueByOptionBySection[name] = value
+    # Return
+    return valueByOptionBySection
+
+
+# Cache
+
+defaultPragmas = []
+runPragmas = []
+datasetCache = collections.OrderedDict()
+datasetCacheLock = threading.Lock()
+datasetCacheSize = 8
+
+
+# Node values
+
+nodeChunkSize = 10000
+rowChunkSize = 10000
+
+def yieldNodeInputPacks(nodeID, nodeInput):
+    'Flatten node inputs into node_values rows, where inputs have an empty section'
+    for option, value in nodeInput.iteritems():
+        yield makeNodeValuePack(nodeID, '', option, value)
+
+def yieldNodeOutputPacks(nodeID, nodeOutput):
+    'Flatten node outputs into node_values rows'
+    for section, valueByOption in nodeOutput.iteritems():
+        for option, value in valueByOption.iteritems():
+            yield makeNodeValuePack(nodeID, section, option, value)
+
+def makeNodeValuePack(nodeID, section, option, value):
+    'Store value both as text and, if possible, as a number'
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        number = None
+    return dict(node_id=nodeID, section=section, option=option, number=number, text=convertToUnicode(value))
+
+def convertToUnicode(value):
+    'Decode byte strings from CSV and shapefile inputs'
+    if isinstance(value, unicode):
+        return value
+    if isinstance(value, str):
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return value.decode('latin-1')
+    return unicode(value)
 
 
 # Define tables
@@ -459,6 +1057,16 @@ nodes_table = sa.Table('nodes', metadata,
     sa.Column('input', sa.types.PickleType(mutable=False)),
     sa.Column('output', sa.types.PickleType(mutable=False)),
 )
+sa.Index('nodes_x_y', nodes_table.c.x, nodes_table.c.y)
+
+node_values_table = sa.Table('node_values', metadata,
+    sa.Column('node_id', sa.ForeignKey('nodes.id'), primary_key=True),
+    sa.Column('section', sa.Unicode, primary_key=True),
+    sa.Column('option', sa.Unicode, primary_key=True),
+    sa.Column('number', sa.Float),
+    sa.Column('text', sa.Unicode),
+)
+sa.Index('node_values_section_option', node_values_table.c.section, node_values_table.c.option)
 
 segments_table = sa.Table('segments', metadata,
     sa.Column('node1_id', sa.ForeignKey('nodes.id'), primary_key=True),
@@ -467,6 +1075,7 @@ segments_table = sa.Table('segments', metadata,
     sa.Column('is_existing', sa.Boolean, default=False),
     sa.Column('weight', sa.Float),
 )
+sa.Index('segments_node2_id', segments_table.c.node2_id)
 
 subnets_table = sa.Table('subnets', metadata,
     sa.Column('id', sa.Integer, primary_key=True),
@@ -507,25 +1116,7 @@ class Node(object):
         return self.longitude, self.latitude
 
     def getValueByOptionBySection(self):
-        # Initialize
-        valueByOptionBySection = collections.defaultdict(dict)
-        # Prepare pattern to detect node-level overrides
-        pattern = re.compile(r'(.*?)\s*>\s*(.*)')
-        # For each attribute,
-        for name, value in self.input.iteritems():
-            # Check whether the attribute is a node-level override
-            match = pattern.match(name)
-            # If the attribute is a node-level override,
-            if match:
-                # Get section and option
-                section, option = match.groups()
-                # Store it
-                valueByOptionBySection[section][option] = value
-            else:
-                # Store it in case it is an alias
-                valueByOptionBySection[name] = value
-        # Return
-        return valueByOptionBySection
+        return parseNodeInput(self.input)
 
     @property
     def __geo_interface__(self):
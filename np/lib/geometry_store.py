@@ -7,7 +7,9 @@ please see http://www.gdal.org/ogr/ogr_formats.html
 """
 # Import system modules
 import os
+import numpy
 import itertools
+import threading
 from osgeo import ogr, osr
 from shapely import wkb, geometry
 # Import custom modules
@@ -19,6 +21,9 @@ proj4LL = '+proj=longlat +ellps=WGS84 +datum=WGS84 +no_defs'
 proj4SM = '+proj=merc +a=6378137 +b=6378137 +lat_ts=0.0 +lon_0=0.0 +x_0=0.0 +y_0=0 +k=1.0 +units=m +nadgrids=@null +no_defs'
 
 
+coordinateTransformationCache = threading.local()
+
+
 # Define shortcuts
 
 def save_points(targetPath, sourceProj4, coordinateTuples, fieldPacks=None, fieldDefinitions=None, driverName='ESRI Shapefile', targetProj4=''):
@@ -112,6 +117,22 @@ def get_transform_point(sourceProj4, targetProj4=proj4LL):
     coordinateTransformation = get_coordinateTransformation(sourceProj4, targetProj4)
     return lambda x, y: coordinateTransformation.TransformPoint(x, y)[:2]
 
+def get_transform_points(sourceProj4, targetProj4=proj4LL):
+    'Return a function that transforms an array of point coordinates with shape (n, 2) in a single call'
+    if sourceProj4 == targetProj4:
+        return lambda xys: numpy.array(xys, dtype=float).reshape(-1, 2)
+    coordinateTransformation = get_coordinateTransformation(sourceProj4, targetProj4)
+    def transform_points(xys):
+        'Transform point coordinates using a single TransformPoints() call'
+        xys = numpy.array(xys, dtype=float).reshape(-1, 2)
+        # If there are no points,
+        if not len(xys):
+            return xys
+        # Return
+        return numpy.array(coordinateTransformation.TransformPoints(xys.tolist()))[:, :2]
+    # Return
+    return transform_points
+
 def get_transform_geometry(sourceProj4, targetProj4=proj4LL):
     'Return a function that transforms a geometry from one spatial reference to another'
     if not targetProj4 or sourceProj4 == targetProj4:
@@ -137,9 +158,16 @@ def get_transform_geometry(sourceProj4, targetProj4=proj4LL):
 
 def get_coordinateTransformation(sourceProj4, targetProj4=proj4LL):
     'Return a CoordinateTransformation that can be used with gdalGeometry.transform()'
-    sourceSRS = get_spatialReference(sourceProj4)
-    targetSRS = get_spatialReference(targetProj4)
-    return osr.CoordinateTransformation(sourceSRS, targetSRS)
+    # Cache per thread because CoordinateTransformation objects are not thread-safe
+    coordinateTransformationByProj4s = coordinateTransformationCache.__dict__.setdefault('coordinateTransformationByProj4s', {})
+    proj4s = sourceProj4, targetProj4
+    # If we have not made this coordinateTransformation yet,
+    if proj4s not in coordinateTransformationByProj4s:
+        sourceSRS = get_spatialReference(sourceProj4)
+        targetSRS = get_spatialReference(targetProj4)
+        coordinateTransformationByProj4s[proj4s] = osr.CoordinateTransformation(sourceSRS, targetSRS)
+    # Return
+    return coordinateTransformationByProj4s[proj4s]
 
 def get_spatialReference(proj4):
     'Return a SpatialReference from proj4'
@@ -51,3 +51,20 @@ def saveMetricsCSV(targetPath, metricModel, valueByOptionBySection):
         value = valueByOptionBySection[section][option]
         csvWriter.writerow([section, option, value])
     csvFile.close()
+
+def saveProfileCSV(targetPath, profiler):
+    'Save per-variable profiling statistics as a CSV file'
+    # Initialize
+    csvFile = open(store.replaceFileExtension(targetPath, 'csv'), 'wt')
+    csvWriter = csv.writer(csvFile)
+    csvWriter.writerow(['section', 'option', 'compute count', 'compute seconds', 'cache hits', 'cache misses', 'parent lookups', 'mean parent depth', 'maximum parent depth'])
+    # For each variable, starting with the most expensive,
+    for variableClass, statistic in profiler.cycleStatistics():
+        csvWriter.writerow([variableClass.section, variableClass.option, statistic.computeCount, '%.6f' % statistic.computeSeconds, statistic.hitCount, statistic.missCount, statistic.lookupCount, '%.2f' % statistic.getLookupDepthMean(), statistic.lookupDepthMaximum])
+    # Add watched counters such as curve cache hits
+    counterPacks = list(profiler.cycleCounters())
+    if counterPacks:
+        csvWriter.writerow([])
+        csvWriter.writerow(['counter', 'name', 'count'])
+        csvWriter.writerows(counterPacks)
+    csvFile.close()
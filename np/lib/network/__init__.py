@@ -1,6 +1,9 @@
 'Framework for building networks using different mathematical models'
 # Import system modules
 import math
+import itertools
+import collections
+import numpy
 import shapely.ops
 import shapely.geometry
 import shapely.topology
@@ -93,10 +96,17 @@ class Segment(object):
         self.node1 = node1
         self.node2 = node2
         self.weight = weight
-        self.lineString = shapely.geometry.LineString([node1.point.coords[0], node2.point.coords[0]])
+        self.geometry = None
         self.targetSegment = targetSegment
         self.is_existing = is_existing
 
+    @property
+    def lineString(self):
+        'Build the geometry of the segment only when we need it'
+        if self.geometry is None:
+            self.geometry = shapely.geometry.LineString([self.node1.point.coords[0], self.node2.point.coords[0]])
+        return self.geometry
+
     def __hash__(self):
         return hash(self.getCoordinates())
     
@@ -149,6 +159,15 @@ class Segment(object):
     def getTargetSegment(self):
         return self.targetSegment
 
+    def getEndpointCoordinates(self):
+        'Return the coordinates of both nodes as x1, y1, x2, y2'
+        return self.getNode1().getCoordinates() + self.getNode2().getCoordinates()
+
+    def getBounds(self):
+        'Return the bounding box of the segment as minX, minY, maxX, maxY'
+        (x1, y1), (x2, y2) = self.getNode1().getCoordinates(), self.getNode2().getCoordinates()
+        return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+
 
 class Network(object):
     'An undirected network'
@@ -159,6 +178,35 @@ class Network(object):
         # Prepare network
         self.subnets = []
 
+    @property
+    def subnets(self):
+        return tuple(self.subnetOrder)
+
+    @subnets.setter
+    def subnets(self, subnets):
+        # Keep subnets in the order in which they last changed, using an ordered dictionary as a set
+        self.subnetOrder = collections.OrderedDict()
+        # Index segments by location so that we only check nearby segments for intersections
+        self.segmentGrid = SegmentGrid(estimateNodeSpacing(self.segmentFactory.getNodes()))
+        # Track which subnet each node belongs to in a disjoint-set forest
+        self.parentByNode = {}
+        self.sizeByRoot = {}
+        self.subnetByRoot = {}
+        # For each subnet,
+        for subnet in subnets:
+            self.addSubnet(subnet)
+
+    def addSubnet(self, subnet):
+        'Add a subnet whose segments do not need to be checked for intersections'
+        # Unite the nodes of the subnet
+        nodes = list(subnet.cycleNodes())
+        if nodes:
+            self.subnetByRoot[self.uniteRoots(self.findRoot(x) for x in nodes)] = subnet
+        self.subnetOrder[subnet] = True
+        # Index segments
+        for segment in subnet.cycleSegments():
+            self.segmentGrid.add(segment)
+
     def addSegmentViaCoordinates(self, node1Coordinates, node2Coordinates):
         self.addSegment(self.segmentFactory.getSegment(node1Coordinates, node2Coordinates))
 
@@ -166,10 +214,25 @@ class Network(object):
         'Add a new segment to the network; return subnet if successful'
         # Initialize
         mergingSubnets = []
-        # For each subnet,
-        for subnet in self.subnets:
+        nearbySegments = list(self.segmentGrid.cycleOverlappingSegments(newSegment))
+        rowIndicesBySubnet = collections.OrderedDict()
+        # Classify intersections with segments whose bounding boxes overlap the new segment in a single call
+        if nearbySegments:
+            codes, xs, ys = classifySegmentIntersections(numpy.array([x.getEndpointCoordinates() for x in nearbySegments], dtype=float), newSegment.getEndpointCoordinates())
+        # Group nearby segments by subnet
+        for rowIndex, segment in enumerate(nearbySegments):
+            rowIndicesBySubnet.setdefault(self.getSubnet(segment.getNode1()), []).append(rowIndex)
+        # Include the subnet of the targetSegment, which might not overlap the new segment
+        targetSegment = newSegment.getTargetSegment()
+        if targetSegment:
+            targetSubnet = self.getSubnet(targetSegment.getNode1())
+            if targetSubnet:
+                rowIndicesBySubnet.setdefault(targetSubnet, [])
+        # For each subnet near the new segment,
+        for subnet, rowIndices in rowIndicesBySubnet.iteritems():
             # Compute intersection
-            intersectionCategory = subnet.categorizeIntersection(newSegment)
+            intersectionPack = (codes[rowIndices], xs[rowIndices], ys[rowIndices]) if rowIndices else None
+            intersectionCategory = subnet.categorizeIntersection(newSegment, [nearbySegments[x] for x in rowIndices], intersectionPack)
             # If we have no intersection,
             if intersectionCategory == 0: 
                 # Ignore subnet
@@ -182,29 +245,72 @@ class Network(object):
             else:
                 # Ignore segment
                 return
-        # Remove subnets that we will merge
-        for subnet in mergingSubnets:
-            self.subnets.remove(subnet)
-        # Add the new subnet
-        subnet = Subnet(sum([x.segments for x in mergingSubnets], []) + [newSegment])
-        self.subnets.append(subnet)
+        # Unite the subnets that we will merge with the nodes of the new segment
+        root = self.uniteRoots([self.findRoot(x.getNode()) for x in mergingSubnets] + [self.findRoot(x) for x in newSegment.getNodes()])
+        # Merge the other subnets into the largest subnet
+        subnet = self.subnetByRoot.get(root) or Subnet([])
+        for mergingSubnet in mergingSubnets:
+            if mergingSubnet is not subnet:
+                subnet.addSegments(mergingSubnet.segments)
+            del self.subnetOrder[mergingSubnet]
+        subnet.addSegments([newSegment])
+        # Add the merged subnet
+        self.subnetByRoot[root] = subnet
+        self.subnetOrder[subnet] = True
+        self.segmentGrid.add(newSegment)
         # Return subnet
         return subnet
 
+    def findRoot(self, node):
+        'Return the node that represents the subnet of the given node'
+        parentByNode = self.parentByNode
+        parent = parentByNode.get(node, node)
+        # While we have not reached the root,
+        while parent is not node:
+            # Point the node to its grandparent to shorten the path
+            grandparent = parentByNode[parent]
+            parentByNode[node] = grandparent
+            node, parent = parent, grandparent
+        # Return
+        return node
+
+    def uniteRoots(self, roots):
+        'Unite the sets of the given roots under the root of the largest set and return it'
+        # Find the root of the largest set, preferring earlier roots in case of a tie
+        sizeByRoot = self.sizeByRoot
+        roots = collections.OrderedDict.fromkeys(roots).keys()
+        root = max(roots, key=lambda x: sizeByRoot.get(x, 1))
+        # For each other root,
+        for otherRoot in roots:
+            if otherRoot is root:
+                continue
+            # Attach it to the largest root
+            self.parentByNode[otherRoot] = root
+            sizeByRoot[root] = sizeByRoot.get(root, 1) + sizeByRoot.pop(otherRoot, 1)
+            self.subnetByRoot.pop(otherRoot, None)
+        # Make sure that the root is in the forest
+        self.parentByNode[root] = root
+        # Return
+        return root
+
+    def getSubnet(self, node):
+        'Return the subnet that contains the node or None'
+        return self.subnetByRoot.get(self.findRoot(node))
+
     def cycleSegments(self):
-        for subnet in self.subnets:
+        for subnet in self.subnetOrder:
             for segment in subnet.cycleSegments():
                 yield segment
 
     def cycleSubnets(self):
-        for subnet in self.subnets:
+        for subnet in self.subnetOrder:
             yield subnet
 
     def countSubnets(self):
-        return len(self.subnets)
+        return len(self.subnetOrder)
 
     def countSegments(self):
-        return sum(x.countSegments() for x in self.subnets)
+        return sum(x.countSegments() for x in self.subnetOrder)
 
     # def saveSHP(self, targetPath):
         # geometry_store.save(store.replaceFileExtension(targetPath, 'shp'), self.proj4, [x.multiLineString for x in self.cycleSubnets()])
@@ -231,6 +337,7 @@ class Network(object):
         projectedSegments = []
         # Convert existing network into a multiLineString
         multiLineString = shapely.geometry.MultiLineString([x.lineString.coords for x in self.cycleSegments()])
+        projectionPacks = []
         # For each node,
         for node in nodes:
             # Load point
@@ -243,8 +350,13 @@ class Network(object):
                 lineString = targetSegment.lineString
                 # Compute the projection of the point onto the targetSegment
                 projectedPoint = lineString.interpolate(lineString.project(point))
-                # Append the projectedSegment
-                projectedSegments.append(self.segmentFactory.getSegment(point.coords[0], projectedPoint.coords[0], targetSegment=targetSegment))
+                projectionPacks.append((point.coords[0], projectedPoint.coords[0], targetSegment))
+        # Create fake nodes for the projected points in a single call
+        self.segmentFactory.addFakeNodes([x[1] for x in projectionPacks])
+        # For each projection,
+        for pointCoordinates, projectedPointCoordinates, targetSegment in projectionPacks:
+            # Append the projectedSegment
+            projectedSegments.append(self.segmentFactory.getSegment(pointCoordinates, projectedPointCoordinates, targetSegment=targetSegment))
         # Return
         return projectedSegments
 
@@ -253,20 +365,42 @@ class Subnet(object):
     'A set of related segments'
 
     def __init__(self, segments):
-        self.segments = segments
-        self.multiLineString = shapely.geometry.MultiLineString([x.lineString.coords for x in segments])
+        self.segments = []
+        self.segmentSet = set()
+        self.addSegments(segments)
+
+    @property
+    def multiLineString(self):
+        'Assemble the geometry of the subnet only when we need it'
+        if self.geometry is None:
+            self.geometry = shapely.geometry.MultiLineString([x.lineString.coords for x in self.segments])
+        return self.geometry
+
+    def addSegments(self, segments):
+        self.segments.extend(segments)
+        self.segmentSet.update(segments)
+        self.geometry = None
 
     def __repr__(self):
         return ', '.join(str(x) for x in self.cycleSegments())
 
-    def categorizeIntersection(self, newSegment):
-        'Figure out whether there are zero, single or multiple intersections'
+    def categorizeIntersection(self, newSegment, nearbySegments=None, intersectionPack=None):
+        'Figure out whether there are zero, single or multiple intersections, optionally checking only the given segments of the subnet'
         # Get intersectionCategory
-        intersectionCategory = categorizeIntersection(self.multiLineString, newSegment.lineString)
+        if nearbySegments is None:
+            intersectionCategory = categorizeIntersection(self.multiLineString, newSegment.lineString)
+        elif nearbySegments:
+            # Count intersections from the orientation predicates if they are conclusive
+            intersectionCategory = countSegmentIntersections(*intersectionPack) if intersectionPack else None
+            # If they are not conclusive, use GEOS
+            if intersectionCategory is None:
+                intersectionCategory = categorizeIntersection(shapely.geometry.MultiLineString([x.lineString.coords for x in nearbySegments]), newSegment.lineString)
+        else:
+            intersectionCategory = 0
         # Get targetSegment
         targetSegment = newSegment.getTargetSegment()
         # If the targetSegment is in our subnet and does not intersect our newSegment,
-        if targetSegment and targetSegment in self.segments and not targetSegment.lineString.intersects(newSegment.lineString):
+        if targetSegment and targetSegment in self.segmentSet and not targetSegment.lineString.intersects(newSegment.lineString):
             # Add one to our intersection count
             intersectionCategory += 1
         # Return
@@ -281,6 +415,10 @@ class Subnet(object):
         for segment in self.segments:
             yield segment
 
+    def getNode(self):
+        'Return a node of the subnet'
+        return self.segments[0].getNode1()
+
     def countNodes(self):
         return len(set(self.cycleNodes()))
 
@@ -302,7 +440,7 @@ class SegmentFactory(object):
         self.segmentByCoordinates = {}
         # Set
         self.computeWeight = computeWeight if computeWeight else lambda x, y: 1
-        self.transform_point = geometry_store.get_transform_point(proj4)
+        self.transform_points = geometry_store.get_transform_points(proj4)
 
     def getNodes(self):
         return self.nodeByCoordinates.values()
@@ -326,18 +464,180 @@ class SegmentFactory(object):
         return segment
 
     def getNode(self, coordinates):
-        # If we recognize the node by its coordinates, return it
-        if coordinates in self.nodeByCoordinates:
-            return self.nodeByCoordinates[coordinates]
-        # Expand coordinates
-        x, y = coordinates
-        # Create a fake node
-        node = Node(self.nodeIndex, (x, y), self.transform_point(x, y), 0)
-        self.nodeIndex -= 1
-        # Store node
-        self.nodeByCoordinates[coordinates] = node
+        # If we do not recognize the node by its coordinates, create it
+        if coordinates not in self.nodeByCoordinates:
+            self.addFakeNodes([coordinates])
         # Return
-        return node
+        return self.nodeByCoordinates[coordinates]
+
+    def addFakeNodes(self, coordinatesList):
+        'Create fake nodes for unrecognized coordinates, transforming them in a single call'
+        # Keep unrecognized coordinates in order
+        newCoordinatesList, newCoordinatesSet = [], set()
+        for coordinates in coordinatesList:
+            if coordinates not in self.nodeByCoordinates and coordinates not in newCoordinatesSet:
+                newCoordinatesList.append(coordinates)
+                newCoordinatesSet.add(coordinates)
+        # For each new node,
+        for (x, y), commonCoordinates in itertools.izip(newCoordinatesList, self.transform_points(newCoordinatesList).tolist()):
+            # Create a fake node
+            node = Node(self.nodeIndex, (x, y), commonCoordinates, 0)
+            self.nodeIndex -= 1
+            # Store node
+            self.nodeByCoordinates[x, y] = node
+
+
+class SegmentGrid(object):
+    'A uniform grid that indexes segments by the cells that their bounding boxes cover'
+
+    def __init__(self, cellSize):
+        self.cellSize = float(cellSize)
+        self.segmentsByCell = {}
+        # Keep segments that cover too many cells in a separate list
+        self.largeSegments = []
+
+    def add(self, segment):
+        # Get cells
+        xIndices, yIndices = self.getCellIndices(segment.getBounds())
+        # If the segment covers too many cells,
+        if len(xIndices) * len(yIndices) > maximumCellCountPerSegment:
+            self.largeSegments.append(segment)
+            return
+        # For each cell,
+        for cell in itertools.product(xIndices, yIndices):
+            self.segmentsByCell.setdefault(cell, []).append(segment)
+
+    def cycleOverlappingSegments(self, segment):
+        'Yield each indexed segment whose bounding box overlaps the bounding box of the given segment'
+        # Prepare
+        bounds = minX, minY, maxX, maxY = segment.getBounds()
+        xIndices, yIndices = self.getCellIndices(bounds)
+        segmentsByCell = self.segmentsByCell
+        visitedSegmentIDs = set()
+        # If the bounding box covers too many cells,
+        if len(xIndices) * len(yIndices) > maximumCellCountPerSegment:
+            # Visit only occupied cells in the same order
+            cells = sorted(x for x in segmentsByCell if xIndices[0] <= x[0] <= xIndices[-1] and yIndices[0] <= x[1] <= yIndices[-1])
+        else:
+            cells = itertools.product(xIndices, yIndices)
+        # For each candidate segment,
+        for cellSegments in itertools.chain((segmentsByCell.get(x, ()) for x in cells), [self.largeSegments]):
+            for cellSegment in cellSegments:
+                # If we have already seen the candidate segment,
+                if id(cellSegment) in visitedSegmentIDs:
+                    continue
+                visitedSegmentIDs.add(id(cellSegment))
+                # If the bounding boxes overlap,
+                cellMinX, cellMinY, cellMaxX, cellMaxY = cellSegment.getBounds()
+                if cellMinX <= maxX and minX <= cellMaxX and cellMinY <= maxY and minY <= cellMaxY:
+                    yield cellSegment
+
+    def getCellIndices(self, (minX, minY, maxX, maxY)):
+        'Return the column and row indices of the cells that cover the bounding box'
+        cellSize = self.cellSize
+        return xrange(int(math.floor(minX / cellSize)), int(math.floor(maxX / cellSize)) + 1), xrange(int(math.floor(minY / cellSize)), int(math.floor(maxY / cellSize)) + 1)
+
+
+def estimateNodeSpacing(nodes):
+    'Return the distance between nodes if they were spread evenly over their bounding box'
+    # If we have too few nodes,
+    if len(nodes) < 2:
+        return 1
+    # Measure the bounding box
+    xs, ys = zip(*(x.getCoordinates() for x in nodes))
+    width, height = max(xs) - min(xs), max(ys) - min(ys)
+    # Estimate
+    if width and height:
+        spacing = math.sqrt(float(width) * height / len(nodes))
+    else:
+        spacing = float(max(width, height)) / (len(nodes) - 1)
+    # Return
+    return spacing or 1
+
+
+def classifySegmentIntersections(segmentMatrix, (x1, y1, x2, y2)):
+    """
+    Classify how the segment intersects each row of x1, y1, x2, y2 in segmentMatrix
+    using orientation predicates and return codes, xs, ys where each code is
+    0 if the segments are disjoint,
+    1 if the segments share exactly one endpoint or one of them is a point on an endpoint of the other,
+    2 if the segments cross at a point inside both segments,
+    3 if the segments have the same endpoints and overlap along their length,
+    -1 if the segments are degenerate or too close to collinear to decide
+    """
+    ax, ay, bx, by = segmentMatrix.T
+    # Compute orientations
+    pqaOrientation, pqaSign = computeOrientations(x1, y1, x2, y2, ax, ay)
+    pqbOrientation, pqbSign = computeOrientations(x1, y1, x2, y2, bx, by)
+    abpSign = computeOrientations(ax, ay, bx, by, x1, y1)[1]
+    abqSign = computeOrientations(ax, ay, bx, by, x2, y2)[1]
+    # Find segments that share an endpoint
+    isPA, isPB = (ax == x1) & (ay == y1), (bx == x1) & (by == y1)
+    isQA, isQB = (ax == x2) & (ay == y2), (bx == x2) & (by == y2)
+    sharedEndpointCount = isPA.astype(int) + isPB + isQA + isQB
+    # Find segments that are points
+    isPoint = ((ax == bx) & (ay == by)) | (x1 == x2 and y1 == y2)
+    # Find the intersection of segments that cross
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        fractions = pqaOrientation / (pqaOrientation - pqbOrientation)
+        xs = numpy.where(isPA | isPB, x1, numpy.where(isQA | isQB, x2, ax + (bx - ax) * fractions))
+        ys = numpy.where(isPA | isPB, y1, numpy.where(isQA | isQB, y2, ay + (by - ay) * fractions))
+    # Classify
+    codes = numpy.select([
+        # If both endpoints of one segment are strictly on the same side of the other segment, they are disjoint
+        (pqaSign * pqbSign > 0) | (abpSign * abqSign > 0),
+        # If one segment is a point on an endpoint of the other, they meet only there
+        isPoint & (sharedEndpointCount > 0),
+        # If the segments share one endpoint and the far endpoint is strictly off the line, they meet only there
+        (sharedEndpointCount == 1) & numpy.where(isPA | isQA, pqbSign, pqaSign).astype(bool),
+        # If the endpoints of each segment are strictly on opposite sides of the other segment, they cross
+        (pqaSign * pqbSign < 0) & (abpSign * abqSign < 0),
+        # If the segments have the same endpoints, they overlap
+        ~isPoint & (isPA & isQB | isPB & isQA),
+    ], [0, 1, 1, 2, 3], -1)
+    # Return
+    return codes, xs, ys
+
+
+def computeOrientations(px, py, qx, qy, rx, ry):
+    'Return twice the signed area of each triangle pqr and its sign, where the sign is zero if rounding errors could flip it'
+    left = (qx - px) * (ry - py)
+    right = (qy - py) * (rx - px)
+    orientations = left - right
+    signs = numpy.sign(orientations)
+    signs[numpy.abs(orientations) <= orientationErrorFactor * (numpy.abs(left) + numpy.abs(right))] = 0
+    return orientations, signs
+
+
+def countSegmentIntersections(codes, xs, ys):
+    'Figure out whether there are zero, single or multiple intersections from classified segments; return None if we need GEOS to decide'
+    # If the new segment overlaps a segment,
+    if (codes == 3).any():
+        return 2
+    # If the predicates could not classify a segment,
+    if (codes < 0).any():
+        return None
+    # If we have no intersections,
+    isIntersecting = codes > 0
+    if not isIntersecting.any():
+        return 0
+    # If a computed crossing falls on the same point as another intersection, only GEOS can tell whether they really meet there
+    pointPacks = zip(xs[isIntersecting].tolist(), ys[isIntersecting].tolist())
+    points = set(pointPacks)
+    if len(points) < len(pointPacks):
+        for crossingPoint in set(itertools.izip(xs[codes == 2].tolist(), ys[codes == 2].tolist())):
+            if pointPacks.count(crossingPoint) > 1:
+                return None
+    # If all intersections are at the same point,
+    if len(points) == 1:
+        return 1
+    # If a computed crossing is so close to another intersection that GEOS might merge them,
+    if (codes == 2).any():
+        for (x1, y1), (x2, y2) in itertools.combinations(points, 2):
+            if abs(x1 - x2) + abs(y1 - y2) <= pointSeparationFactor * max(abs(x1), abs(y1), 1):
+                return None
+    # We have more than one intersection
+    return 2
 
 
 def categorizeIntersection(multiLineString, lineString):
@@ -424,6 +724,12 @@ def computeSphericalDistance(node1, node2):
     return earthRadiusInMeters * math.atan2(y, x)
 
 
+
+maximumCellCountPerSegment = 64
+# Bound the relative rounding error of an orientation computed in double precision
+orientationErrorFactor = (3 + 16 * numpy.finfo(float).eps) * numpy.finfo(float).eps
+pointSeparationFactor = 1e-9
+
 """
 Someone should fix the following workarounds after GEOS fixes their bugs.
 
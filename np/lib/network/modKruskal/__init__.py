@@ -83,11 +83,13 @@ class VariableStore(variable_store.VariableStore):
                 raise variable_store.VariableError('Could not find shapefile in ZIP archive for existing networks')
             # Load network
             networkProj4, networkGeometries = geometry_store.load(networkPath)[:2]
-            networkCoordinatePairs = network.yieldSimplifiedCoordinatePairs(networkGeometries)
-            # Prepare
-            transform_point = geometry_store.get_transform_point(networkProj4, proj4)
+            networkCoordinatePairs = list(network.yieldSimplifiedCoordinatePairs(networkGeometries))
+            # Transform vertices in a single call
+            transform_points = geometry_store.get_transform_points(networkProj4, proj4)
+            networkCoordinatePairs = [tuple(map(tuple, x)) for x in transform_points([c for pair in networkCoordinatePairs for c in pair]).reshape(-1, 2, 2).tolist()]
+            segmentFactory.addFakeNodes([c for pair in networkCoordinatePairs for c in pair])
             # Load existing network as a single subnet and allow overlapping segments
-            net.subnets.append(network.Subnet([segmentFactory.getSegment(transform_point(c1[0], c1[1]), transform_point(c2[0], c2[1]), is_existing=True) for c1, c2 in networkCoordinatePairs]))
+            net.addSubnet(network.Subnet([segmentFactory.getSegment(c1, c2, is_existing=True) for c1, c2 in networkCoordinatePairs]))
             # Add candidate segments that connect each node to its projection on the existing network
             segments.extend(net.project(networkNodes))
         # Prepare matrix where the rows are nodes and the columns are node coordinates
@@ -117,12 +119,15 @@ class VariableStore(variable_store.VariableStore):
         OTHERWISE WEIGHTS WILL NOT UPDATE
         """
         print 'Building network from segments...'
+        # Store the remaining budget of each subnet on the root of its nodes, where nodes outside subnets keep their own weight
+        weightByRoot = {}
+        getWeight = lambda node: weightByRoot.get(net.findRoot(node), node.getWeight())
         # Cycle segments starting with the smallest first
         for segment in sorted(segments, key=lambda x: x.getWeight()):
             # Prepare
             node1, node2 = segment.getNodes()
             # Prepare
-            n1Weight, n2Weight, sWeight = node1.getWeight(), node2.getWeight(), segment.getWeight()
+            n1Weight, n2Weight, sWeight = getWeight(node1), getWeight(node2), segment.getWeight()
             node1Qualifies = n1Weight >= sWeight or node1.getID() < 0 # canAfford or isFake
             node2Qualifies = n2Weight >= sWeight or node2.getID() < 0 # canAfford or isFake
             # If the segment qualifies,
@@ -131,9 +136,7 @@ class VariableStore(variable_store.VariableStore):
                 subnet = net.addSegment(segment)
                 # If the segment was added,
                 if subnet:
-                    weight = n1Weight + n2Weight - sWeight
-                    for node in subnet.cycleNodes():
-                        node.setWeight(weight)
+                    weightByRoot[net.findRoot(node1)] = n1Weight + n2Weight - sWeight
         # Return
         return net
 
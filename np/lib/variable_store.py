@@ -5,6 +5,8 @@ Classes for caching variables
 !!! Add support for html_output property
 """
 # Import system modules
+import time
+import itertools
 import collections
 
 
@@ -18,47 +20,95 @@ class VariableStore(object):
     aggregateClasses = None
     summaryClasses = None
 
-    def __init__(self, valueByOptionBySection=None, variableStore=None, state=None):
-        'Prepare cache and remember parent'
+    def __init__(self, valueByOptionBySection=None, variableStore=None, state=None, isTyped=False):
+        'Prepare cache and remember parent, where isTyped=True means that values other than text are already parsed'
         # Initialize
-        if not self.variableModules: 
-            self.variableModules = []
-        if not self.variableClasses: 
-            self.variableClasses = []
-        if not self.aggregateClasses: 
-            self.aggregateClasses = []
-        if not self.summaryClasses: 
-            self.summaryClasses = []
+        self.compileModel()
         if not valueByOptionBySection: 
             valueByOptionBySection = {}
         self.variableStore = variableStore
         self.variableByClass = {}
+        self.hoistedVariableByClass = {}
         self.state = state
+        self.invariantClasses = variableStore.invariantClasses if variableStore else frozenset()
+        # Prepare cache
+        for variableClass, value in self.extractVariableValues(valueByOptionBySection):
+            # Store the variable by class in the cache
+            self.set(variableClass, value, isTyped)
+        # If we do not have a parent,
+        if not variableStore:
+            # For each variable that has a default value,
+            for variableClass in self.defaultClasses:
+                # Use the default value if it was not specified
+                if variableClass not in self.variableByClass:
+                    self.set(variableClass)
+
+    @classmethod
+    def compileModel(cls):
+        'Gather, validate and index variable classes once per VariableStore subclass'
+        # If the model is already compiled,
+        if cls.__dict__.get('isCompiled'):
+            return
+        # Initialize
+        variableClasses = list(cls.variableClasses or [])
         # Populate variableClasses using variableModules
-        for variableModule in self.variableModules:
+        for variableModule in cls.variableModules or []:
             # For each class name in the module,
             for variableClassName in dir(variableModule):
                 # Convert the class name into a class
                 variableClass = getattr(variableModule, variableClassName)
                 # If the class is a new variable,
-                if isinstance(variableClass, type) and issubclass(variableClass, Variable) and variableClass != Variable and variableClass not in self.variableClasses:
+                if isinstance(variableClass, type) and issubclass(variableClass, Variable) and variableClass != Variable and variableClass not in variableClasses:
                     # Append class
-                    self.variableClasses.append(variableClass)
+                    variableClasses.append(variableClass)
+        cls.variableModules = list(cls.variableModules or [])
+        cls.variableClasses = variableClasses
+        cls.aggregateClasses = list(cls.aggregateClasses or [])
+        cls.summaryClasses = list(cls.summaryClasses or [])
         # Make sure there are no name or alias overlaps
-        validateVariableClasses(self.variableClasses + self.aggregateClasses + self.summaryClasses)
-        # Prepare cache
-        for variableClass in self.variableClasses:
-            # Extract
-            storeInCache, value = extractVariableValue(valueByOptionBySection, variableClass, variableStore)
-            # If we need to store the variable in the cache,
-            if storeInCache:
-                # Store the variable by class in the cache
-                self.set(variableClass, value)
-
-    def set(self, variableClass, value=None):
+        validateVariableClasses(cls.variableClasses + cls.aggregateClasses + cls.summaryClasses)
+        # Index variableClasses by alias, remembering the alias rank, and by section and option
+        cls.variableClassByAlias = dict((alias, (x, aliasIndex)) for x in variableClasses for aliasIndex, alias in enumerate(x.aliases or []))
+        cls.variableClassesBySection = collections.defaultdict(dict)
+        for variableClass in variableClasses:
+            cls.variableClassesBySection[variableClass.section][variableClass.option] = variableClass
+        cls.variableClassesBySection = dict(cls.variableClassesBySection)
+        cls.defaultClasses = [x for x in variableClasses if x.default != None]
+        # Precompute the transitive dependencies of each variable
+        cls.dependencyClosureByClass = {}
+        for variableClass in cls.variableClasses + cls.aggregateClasses + cls.summaryClasses:
+            getDependencyClosure(variableClass, cls.dependencyClosureByClass)
+        cls.isCompiled = True
+
+    @classmethod
+    def extractVariableValues(cls, valueByOptionBySection):
+        'Return (variableClass, value) for each value that matches a variable, where aliases take precedence'
+        # Initialize
+        valueByClass = {}
+        aliasPacks = []
+        # For each key,
+        for key, value in valueByOptionBySection.iteritems():
+            # If the key is a section,
+            if key in cls.variableClassesBySection and isinstance(value, dict):
+                variableClassByOption = cls.variableClassesBySection[key]
+                # Store values for matching options
+                for option, optionValue in value.iteritems():
+                    if option in variableClassByOption:
+                        valueByClass[variableClassByOption[option]] = optionValue
+            # If the key is an alias,
+            if key in cls.variableClassByAlias:
+                variableClass, aliasIndex = cls.variableClassByAlias[key]
+                aliasPacks.append((aliasIndex, variableClass, value))
+        # Let aliases override sections, where earlier aliases win
+        for aliasIndex, variableClass, value in sorted(aliasPacks, reverse=True):
+            valueByClass[variableClass] = value
+        # Return values before empty values so that computed variables see the cache filled
+        return sorted(valueByClass.iteritems(), key=lambda x: x[1] == None or x[1] == '')
+
+    def set(self, variableClass, value=None, isTyped=False):
         'Set the value of the variable corresponding to the given class'
         # Store the variable by class in the cache
-        self.variableByClass[variableClass] = variableClass(self, value)
+        self.variableByClass[variableClass] = variableClass(self, value, isTyped)
 
     def get(self, variableClass):
         return self.getVariable(variableClass).value
@@ -69,8 +119,16 @@ class VariableStore(object):
         if variableClass in self.variableByClass:
             # Return the variable from the cache
             return self.variableByClass[variableClass]
-        # If the variable has dependencies and any of the variable's dependencies are in the cache,
-        if variableClass.dependencies and self.has(variableClass.dependencies):
+        # If we hoisted the variable into this store,
+        if variableClass in self.hoistedVariableByClass:
+            # Return the variable without treating it as configuration
+            return self.hoistedVariableByClass[variableClass]
+        # If the variable does not depend on node-level overrides and a parent is defined,
+        if variableClass in self.invariantClasses and self.variableStore:
+            # Get the variable from the parent without checking dependencies
+            variable = self.variableStore.getVariable(variableClass)
+        # If any of the variable's direct or indirect dependencies are in the cache,
+        elif not getDependencyClosure(variableClass, self.dependencyClosureByClass).isdisjoint(self.variableByClass):
             # Recompute the variable
             variable = variableClass(self)
         # If a parent is defined,
@@ -85,12 +143,12 @@ class VariableStore(object):
         # Return the variable
         return variable
 
-    def getVariableByOptionBySection(self):
-        'Return variables arranged by section'
+    def getVariableByOptionBySection(self, withHoisted=False):
+        'Return variables arranged by section, where withHoisted=True adds variables hoisted into this store as child stores see them'
         # Initialize
-        variableByOptionBySection = self.variableStore.getVariableByOptionBySection() if self.variableStore else {}
+        variableByOptionBySection = self.variableStore.getVariableByOptionBySection(withHoisted=True) if self.variableStore else {}
         # For each variable in the cache,
-        for x in self.variableByClass.values():
+        for x in (self.hoistedVariableByClass.values() if withHoisted else []) + self.variableByClass.values():
             # Update
             if x.section not in variableByOptionBySection:
                 variableByOptionBySection[x.section] = {}
@@ -115,12 +173,16 @@ class VariableStore(object):
         # Return
         return valueByOptionBySection
 
+    def getTypedValueByOptionBySection(self):
+        'Return variable values arranged by section without formatting them'
+        return dict((section, dict((option, variable.value) for option, variable in variableByOption.iteritems())) for section, variableByOption in self.getVariableByOptionBySection().iteritems())
+
     def has(self, variableClasses):
-        'Return true if any of the variables are in the cache'
+        'Return true if any of the variables or their dependencies are in the cache'
         # For each variableClass,
         for variableClass in variableClasses:
             # If the variableClass is in the cache or any of its dependencies is in the cache,
-            if variableClass in self.variableByClass or (variableClass.dependencies and self.has(variableClass.dependencies)):
+            if variableClass in self.variableByClass or not getDependencyClosure(variableClass, self.dependencyClosureByClass).isdisjoint(self.variableByClass):
                 # Return true
                 return True
         # Return false
@@ -144,6 +206,23 @@ class VariableStore(object):
             # Compute
             self.get(summaryClass)
 
+    def hoistVariables(self, variableClasses):
+        'Compute node-invariant variables once so that child stores take them from this store and return the hoisted classes'
+        state = self.state
+        self.state = JobState(state)
+        cachedClasses = set(self.variableByClass)
+        try:
+            self.invariantClasses = frozenset(hoistVariables(self.get, variableClasses))
+        finally:
+            self.state = state
+            # Keep computed values apart so that getValueByOptionBySection returns only the configuration
+            moveValues(self.variableByClass, self.hoistedVariableByClass, cachedClasses)
+        return self.invariantClasses
+
+    def makeChild(self, valueByOptionBySection=None, state=None, isTyped=False):
+        'Return a store that overrides this one, such as a node-level store'
+        return self.__class__(valueByOptionBySection, self, state, isTyped)
+
 
 # Variable
 
@@ -158,7 +237,7 @@ class Variable(object):
     dependencies = None
     units = ''
 
-    def __init__(self, variableStore, value=None):
+    def __init__(self, variableStore, value=None, isTyped=False):
         # Initialize
         if not self.aliases:
             self.aliases = []
@@ -183,6 +262,9 @@ class Variable(object):
         if value == None or value == '':
             # Compute the value if we do not have a default
             self.value = self.compute() if self.default == None else self.c['parse'](self.default)
+        # If we have a value that was already parsed,
+        elif isTyped and not isinstance(value, basestring):
+            self.value = value
         # If we have a value,
         else:
             # Parse the value
@@ -208,8 +290,283 @@ class Variable(object):
         return self.default
 
 
+# Evaluator
+
+class VariableEvaluator(object):
+    'Evaluate the variables of a model on demand using plain values instead of Variable instances'
+
+    def __init__(self, modelClass, valueByOptionBySection=None, state=None):
+        # Load precompiled model
+        modelClass.compileModel()
+        self.modelClass = modelClass
+        self.state = state
+        self.invariantClasses = frozenset()
+        # Prepare job-level values in the same way as a VariableStore without a parent
+        self.jobContext = EvaluationContext(self, None)
+        self.jobContext.setValues(valueByOptionBySection or {})
+        for variableClass in modelClass.defaultClasses:
+            if variableClass not in self.jobContext.valueByClass:
+                self.jobContext.setValue(variableClass, None)
+
+    def hoistVariables(self, variableClasses):
+        'Compute node-invariant variables once so that node contexts take them from the job context and return the hoisted classes'
+        state = self.jobContext.state
+        self.jobContext.state = JobState(state)
+        cachedClasses = set(self.jobContext.valueByClass)
+        try:
+            self.invariantClasses = frozenset(hoistVariables(self.jobContext.get, variableClasses))
+        finally:
+            self.jobContext.state = state
+            # Keep computed values apart so that getValueByOptionBySection returns only the configuration
+            moveValues(self.jobContext.valueByClass, self.jobContext.hoistedValueByClass, cachedClasses)
+        return self.invariantClasses
+
+    def makeChild(self, valueByOptionBySection=None, state=None, isTyped=False):
+        'Return a context for node-level overrides that falls back to job-level values'
+        nodeContext = EvaluationContext(self, self.jobContext, state)
+        nodeContext.setValues(valueByOptionBySection or {}, isTyped)
+        return nodeContext
+
+    def get(self, variableClass):
+        return self.jobContext.get(variableClass)
+
+    def getValueByOptionBySection(self):
+        return self.jobContext.getValueByOptionBySection()
+
+    def getTypedValueByOptionBySection(self):
+        return self.jobContext.getTypedValueByOptionBySection()
+
+
+class EvaluationContext(object):
+    'Hold the values of a single level of the hierarchy for VariableEvaluator'
+
+    def __init__(self, evaluator, parentContext, state=None):
+        self.evaluator = evaluator
+        self.parentContext = parentContext
+        self.state = state if state is not None else evaluator.state
+        self.valueByClass = {}
+        self.hoistedValueByClass = {}
+        self.textByClass = {}
+
+    def setValues(self, valueByOptionBySection, isTyped=False):
+        'Store overrides, where empty values are computed after the other overrides and isTyped=True means that values other than text are already parsed'
+        for variableClass, value in self.evaluator.modelClass.extractVariableValues(valueByOptionBySection):
+            self.setValue(variableClass, value, isTyped)
+
+    def setValue(self, variableClass, value, isTyped=False):
+        'Parse, default or compute the value in the same way as Variable'
+        # If we do not have a value,
+        if value == None or value == '':
+            # Compute the value if we do not have a default
+            value = self.compute(variableClass) if variableClass.default == None else self.check(variableClass, getMethod(variableClass, 'parse', float)(variableClass.default))
+        # If we have a value that was already parsed,
+        elif isTyped and not isinstance(value, basestring):
+            value = self.check(variableClass, value)
+        # If we have a value,
+        else:
+            value = self.check(variableClass, getMethod(variableClass, 'parse', float)(value))
+        # Store
+        self.valueByClass[variableClass] = value
+        return value
+
+    def get(self, variableClass):
+        'Return the value of the variable using the same caching rules as VariableStore.getVariable'
+        try:
+            return self.valueByClass[variableClass]
+        except KeyError:
+            pass
+        # If we hoisted the variable into this context,
+        if variableClass in self.hoistedValueByClass:
+            return self.hoistedValueByClass[variableClass]
+        # If the variable does not depend on node-level overrides and a parent is defined,
+        if variableClass in self.evaluator.invariantClasses and self.parentContext:
+            value = self.parentContext.get(variableClass)
+        # If any of the variable's direct or indirect dependencies are in the cache,
+        elif not getDependencyClosure(variableClass, self.evaluator.modelClass.dependencyClosureByClass).isdisjoint(self.valueByClass):
+            value = self.compute(variableClass)
+        # If a parent is defined,
+        elif self.parentContext:
+            value = self.parentContext.get(variableClass)
+        # Otherwise,
+        else:
+            raise VariableError('Unable to get ' + variableClass.__name__)
+        # Store
+        self.valueByClass[variableClass] = value
+        return value
+
+    def compute(self, variableClass):
+        'Run the compute method of the variable against this context'
+        return self.check(variableClass, variableClass.compute.im_func(self))
+
+    def check(self, variableClass, value):
+        'Validate the value if the variable defines a check'
+        checkValue = getMethod(variableClass, 'check', None)
+        if checkValue:
+            try:
+                checkValue(value)
+            except AssertionError, error:
+                raise VariableError('"%s > %s" ' % (variableClass.section, variableClass.option) + str(error))
+        return value
+
+    def getValueByOptionBySection(self, withHoisted=False):
+        'Return formatted values arranged by section, where formatted job-level values are reused and withHoisted=True adds hoisted values'
+        # Initialize
+        valueByOptionBySection = self.parentContext.getValueByOptionBySection(withHoisted=True) if self.parentContext else {}
+        textByClass = self.textByClass
+        # For each value,
+        for variableClass, value in itertools.chain(self.hoistedValueByClass.iteritems() if withHoisted else (), self.valueByClass.iteritems()):
+            # Format
+            if variableClass not in textByClass:
+                textByClass[variableClass] = getMethod(variableClass, 'format', str)(value)
+            # Update
+            if variableClass.section not in valueByOptionBySection:
+                valueByOptionBySection[variableClass.section] = {}
+            valueByOptionBySection[variableClass.section][variableClass.option] = textByClass[variableClass]
+        # Return
+        return valueByOptionBySection
+
+    def getTypedValueByOptionBySection(self, withHoisted=False):
+        'Return values arranged by section without formatting them, where withHoisted=True adds hoisted values'
+        valueByOptionBySection = self.parentContext.getTypedValueByOptionBySection(withHoisted=True) if self.parentContext else {}
+        for variableClass, value in itertools.chain(self.hoistedValueByClass.iteritems() if withHoisted else (), self.valueByClass.iteritems()):
+            valueByOptionBySection.setdefault(variableClass.section, {})[variableClass.option] = value
+        return valueByOptionBySection
+
+
+class JobState(object):
+    'Stand in for the state while hoisting so that variables that need node-level state raise NodeStateError'
+
+    def __init__(self, state):
+        self.state = state
+
+    def __getitem__(self, index):
+        try:
+            return self.state[index]
+        except (TypeError, IndexError):
+            raise NodeStateError('State %s is not available at the job level' % index)
+
+
+# Profiler
+
+class VariableProfiler(object):
+    'Record per-variable computations, cache hits and misses, parent lookups and compute time across many stores'
+
+    def __init__(self):
+        self.statisticByClass = collections.defaultdict(VariableStatistic)
+        self.modelClassByClass = {}
+        self.childSecondsStack = []
+        self.counterPacks = []
+
+    def wrap(self, modelClass):
+        'Return a subclass of the VariableStore that reports to this profiler'
+        if modelClass not in self.modelClassByClass:
+            self.modelClassByClass[modelClass] = makeProfiledModel(modelClass, self)
+        return self.modelClassByClass[modelClass]
+
+    def getVariable(self, variableStore, variableClass, getVariable):
+        'Resolve the variable and record how the store resolved it'
+        statistic = self.statisticByClass[variableClass]
+        # If the variable is in the cache,
+        if variableClass in variableStore.variableByClass:
+            statistic.hitCount += 1
+            return variableStore.variableByClass[variableClass]
+        statistic.missCount += 1
+        # Resolve
+        seconds = self.measure(getVariable, variableClass)
+        variable = variableStore.variableByClass[variableClass]
+        # If the store computed the variable,
+        if variable.variableStore is variableStore:
+            statistic.computeCount += 1
+            statistic.computeSeconds += seconds
+        # If the variable came from a parent,
+        else:
+            parentDepth = 0
+            while variableStore is not None and variableStore is not variable.variableStore:
+                variableStore = variableStore.variableStore
+                parentDepth += 1
+            statistic.lookupCount += 1
+            statistic.lookupDepthSum += parentDepth
+            statistic.lookupDepthMaximum = max(statistic.lookupDepthMaximum, parentDepth)
+        # Return
+        return variable
+
+    def set(self, variableStore, variableClass, value, isTyped, set):
+        'Store the variable and record the time if it had to be computed'
+        seconds = self.measure(set, variableClass, value, isTyped)
+        # If the value was computed instead of parsed,
+        if (value == None or value == '') and variableClass.default == None:
+            statistic = self.statisticByClass[variableClass]
+            statistic.computeCount += 1
+            statistic.computeSeconds += seconds
+
+    def measure(self, function, *args):
+        'Call the function and return the seconds spent outside nested lookups'
+        self.childSecondsStack.append(0)
+        startTime = time.time()
+        try:
+            function(*args)
+        finally:
+            elapsedSeconds = time.time() - startTime
+            childSeconds = self.childSecondsStack.pop()
+            # Let the enclosing lookup exclude our time from its own
+            if self.childSecondsStack:
+                self.childSecondsStack[-1] += elapsedSeconds
+        return elapsedSeconds - childSeconds
+
+    def watch(self, counterName, getCountByName):
+        'Report how much external counters, such as cache hits, change while profiling'
+        self.counterPacks.append((counterName, getCountByName, getCountByName()))
+
+    def cycleCounters(self):
+        'Return (counterName, name, count) for each watched counter, where counts start when we began watching'
+        for counterName, getCountByName, startCountByName in self.counterPacks:
+            for name, count in sorted(getCountByName().iteritems()):
+                yield counterName, name, count - startCountByName.get(name, 0)
+
+    def cycleStatistics(self):
+        'Return (variableClass, statistic) pairs, starting with the most expensive'
+        return sorted(self.statisticByClass.iteritems(), key=lambda x: (-x[1].computeSeconds, x[0].section, x[0].option))
+
+
+class VariableStatistic(object):
+    'Counters for a single variable'
+
+    __slots__ = ['computeCount', 'computeSeconds', 'hitCount', 'missCount', 'lookupCount', 'lookupDepthSum', 'lookupDepthMaximum']
+
+    def __init__(self):
+        self.computeCount = 0
+        self.computeSeconds = 0
+        self.hitCount = 0
+        self.missCount = 0
+        self.lookupCount = 0
+        self.lookupDepthSum = 0
+        self.lookupDepthMaximum = 0
+
+    def getLookupDepthMean(self):
+        return self.lookupDepthSum / float(self.lookupCount) if self.lookupCount else 0
+
+
+def makeProfiledModel(modelClass, profiler):
+    'Return a subclass of the VariableStore that reports to the profiler, leaving the original untouched'
+
+    class ProfiledVariableStore(modelClass):
+
+        def getVariable(self, variableClass):
+            return profiler.getVariable(self, variableClass, super(ProfiledVariableStore, self).getVariable)
+
+        def set(self, variableClass, value=None, isTyped=False):
+            profiler.set(self, variableClass, value, isTyped, super(ProfiledVariableStore, self).set)
+
+    ProfiledVariableStore.__name__ = 'Profiled' + modelClass.__name__
+    return ProfiledVariableStore
+
+
 # Helpers
 
+def getMethod(variableClass, methodName, defaultMethod):
+    'Return the method that the variable defines in c or the given default'
+    return (variableClass.c or {}).get(methodName, defaultMethod)
+
 def buildSectionPacks(model):
     'Gather each section and its variables in order'
     # Grok model
@@ -228,6 +585,7 @@ def buildSectionPacks(model):
 def gatherVariables(modelClass):
     'Gather variables from the model'
     # Initialize
+    modelClass.compileModel()
     variableClasses = set()
     nextClasses = []
     if modelClass.variableClasses:
@@ -253,6 +611,95 @@ def gatherVariables(modelClass):
     # Return
     return variableClasses, rootClasses
 
+def getChangedVariableClasses(modelClass, valueByOptionBySection1, valueByOptionBySection2):
+    'Return variables whose configured values differ between two configurations'
+    # Compare configured values variable by variable
+    return set(x for x in gatherVariables(modelClass)[0] if extractVariableValue(valueByOptionBySection1, x, None) != extractVariableValue(valueByOptionBySection2, x, None))
+
+def getAffectedVariableClasses(modelClass, changedVariableClasses):
+    'Return the changed variables together with all variables that depend on them'
+    # Index derivatives
+    derivativesByVariable = collections.defaultdict(list)
+    for variableClass in gatherVariables(modelClass)[0]:
+        for dependency in variableClass.dependencies or []:
+            derivativesByVariable[dependency].append(variableClass)
+    # Initialize
+    affectedClasses = set()
+    nextClasses = list(changedVariableClasses)
+    # While there are more,
+    while nextClasses:
+        variableClass = nextClasses.pop()
+        # If we have already visited the variableClass,
+        if variableClass in affectedClasses:
+            continue
+        # Mark it and its derivatives
+        affectedClasses.add(variableClass)
+        nextClasses.extend(derivativesByVariable[variableClass])
+    # Return
+    return affectedClasses
+
+def getInvariantVariableClasses(modelClass, overridableClasses):
+    'Return variables that neither are overridable nor depend directly or indirectly on an overridable variable'
+    modelClass.compileModel()
+    overridableClasses = frozenset(overridableClasses)
+    return [x for x in modelClass.variableClasses if x not in overridableClasses and getDependencyClosure(x, modelClass.dependencyClosureByClass).isdisjoint(overridableClasses)]
+
+def hoistVariables(get, variableClasses):
+    'Compute each variable using the given getter and return the variables that we could compute'
+    hoistedClasses = []
+    # For each variableClass,
+    for variableClass in variableClasses:
+        try:
+            get(variableClass)
+        # Leave variables that need node-level state, such as the network, to each node
+        except NodeStateError:
+            continue
+        hoistedClasses.append(variableClass)
+    # Return
+    return hoistedClasses
+
+def moveValues(valueByClass, targetValueByClass, keptClasses):
+    'Move values of classes other than the kept classes from one cache to the other'
+    for variableClass in set(valueByClass).difference(keptClasses):
+        targetValueByClass[variableClass] = valueByClass.pop(variableClass)
+
+def formatValueByOptionBySection(modelClass, valueByOptionBySection):
+    'Format typed values arranged by section using the format method of each variable, leaving text as it is'
+    # Initialize
+    modelClass.compileModel()
+    textByOptionBySection = {}
+    # For each section,
+    for section, valueByOption in valueByOptionBySection.iteritems():
+        variableClassByOption = modelClass.variableClassesBySection.get(section, {})
+        textByOption = textByOptionBySection[section] = {}
+        # For each option,
+        for option, value in valueByOption.iteritems():
+            # If the value is already text,
+            if isinstance(value, basestring):
+                textByOption[option] = value
+            # If the value belongs to a variable,
+            elif option in variableClassByOption:
+                textByOption[option] = getMethod(variableClassByOption[option], 'format', str)(value)
+            else:
+                textByOption[option] = str(value)
+    # Return
+    return textByOptionBySection
+
+def getDependencyClosure(variableClass, dependencyClosureByClass):
+    'Return the frozenset of direct and indirect dependencies of the variableClass'
+    # If we have already computed the closure,
+    if variableClass in dependencyClosureByClass:
+        return dependencyClosureByClass[variableClass]
+    # Combine each dependency with its own dependencies
+    dependencyClosure = set()
+    for dependency in variableClass.dependencies or []:
+        dependencyClosure.add(dependency)
+        dependencyClosure.update(getDependencyClosure(dependency, dependencyClosureByClass))
+    # Store
+    dependencyClosure = dependencyClosureByClass[variableClass] = frozenset(dependencyClosure)
+    # Return
+    return dependencyClosure
+
 def validateVariableClasses(variableClasses):
     'Make sure there are no name or alias overlaps'
     # Initialize
@@ -327,3 +774,7 @@ inputFile = """\
 
 class VariableError(Exception):
     pass
+
+
+class NodeStateError(VariableError):
+    pass
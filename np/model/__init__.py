@@ -4,6 +4,7 @@ from pylons import config
 # Import system modules
 import os
 import cjson
+import shutil
 import urllib
 import hashlib
 import datetime
@@ -12,7 +13,7 @@ import sqlalchemy.orm as orm
 # Import custom modules
 from np.model.meta import Session, Base
 from np.config import parameter
-from np.lib import store, dataset_store, metric, network
+from np.lib import store, dataset_store, metric, network, variable_store, curve
 
 
 # Define methods
@@ -25,6 +26,25 @@ def hashString(string):
     'Compute the hash of the string'
     return hashlib.sha256(string).digest()
 
+def hashConfigurationFiles(folder, configurationModel, configuration):
+    'Compute the hash of each file that the configuration references so that we notice when a file changes under the same name'
+    configurationModel.VariableStore.compileModel()
+    digestByPath = {}
+    # For each value,
+    for variableClass, relativePath in configurationModel.VariableStore.extractVariableValues(configuration):
+        # If the value is not a file,
+        if (variableClass.c or {}).get('input') != variable_store.inputFile or not relativePath:
+            continue
+        # Hash
+        path = os.path.join(folder, relativePath)
+        digestByPath[relativePath] = hashlib.sha256(open(path, 'rb').read()).hexdigest() if os.path.exists(path) else None
+    # Return
+    return digestByPath
+
+def zipScenarioFolder(scenarioFolder):
+    'Zip the scenario folder for download, leaving out the parent dataset that we only keep to rerun the scenario'
+    store.zipFolder(scenarioFolder + '.zip', scenarioFolder, excludes=[parentDatasetFileName])
+
 
 # Set constants
 
@@ -36,6 +56,7 @@ statusDictionary = {
     statusFailed: 'Failed',
 }
 scopePrivate, scopePublic = xrange(2)
+parentDatasetFileName = 'parent.db'
 
 
 # Define tables
@@ -122,7 +143,8 @@ class Scenario(object):
         return store.binPath(os.path.join(config['storage_path'], 'scenarios'), self.id)
 
     def getDataset(self):
-        return dataset_store.load(self.getDatasetPath())
+        'Return a read-only dataset from the process-wide cache'
+        return dataset_store.loadCached(self.getDatasetPath())
 
     def getDatasetPath(self):
         return os.path.join(self.getFolder(), 'dataset.db')
@@ -162,41 +184,72 @@ class Scenario(object):
         scenarioInput = self.input
         scenarioFolder = self.getFolder()
         expandPath = lambda x: os.path.join(scenarioFolder, x)
-        # Register demographics
-        print 'Registering demographics'
-        nodesPath = expandPath('nodes')
         targetPath = self.getDatasetPath()
-        sourcePath = expandPath(scenarioInput['demographic file name'])
-        datasetStore = dataset_store.create(targetPath, sourcePath)
-        datasetStore.saveNodesSHP(nodesPath)
-        datasetStore.saveNodesCSV(nodesPath)
-        # Apply metric
-        print 'Applying metric'
+        parentPath = expandPath(parentDatasetFileName)
+        parentInput = scenarioInput.get('parent scenario input')
         metricModel = metric.getModel(scenarioInput['metric model name'])
         metricConfiguration = scenarioInput['metric configuration']
-        metricValueByOptionBySection = datasetStore.applyMetric(metricModel, metricConfiguration)
-        # Build network
-        print 'Building network'
         networkModel = network.getModel(scenarioInput['network model name'])
         networkConfiguration = scenarioInput['network configuration']
-        networkValueByOptionBySection = datasetStore.buildNetwork(networkModel, networkConfiguration)
+        metricEngineName = scenarioInput.get('metric engine name')
+        profiler = variable_store.VariableProfiler() if dataset_store.isMetricProfiled else None
+        if profiler:
+            profiler.watch('curve cache', curve.getCacheCounts)
+        # If we can reuse the results of the parent scenario,
+        if parentInput and os.path.exists(parentPath) and parentInput['metric model name'] == scenarioInput['metric model name']:
+            # Load parent dataset
+            print 'Reusing parent dataset'
+            dataset_store.forgetCached(targetPath)
+            # Copy so that we can run the scenario again from the parent dataset
+            shutil.copyfile(parentPath, targetPath)
+            datasetStore = dataset_store.load(targetPath, dataset_store.runPragmas)
+            # Recompute variables affected by changed parameters
+            print 'Reapplying metric'
+            metricValueByOptionBySection, isMetricChanged = datasetStore.reapplyMetric(metricModel, metricConfiguration, parentInput['metric configuration'], metricEngineName, profiler)
+            # If the metric, network configuration or files that the network configuration references changed,
+            if isMetricChanged or parentInput['network model name'] != scenarioInput['network model name'] or parentInput['network configuration'] != networkConfiguration or parentInput.get('network file digests', {}) != hashConfigurationFiles(scenarioFolder, networkModel, networkConfiguration):
+                print 'Rebuilding network'
+                datasetStore.removeNetwork()
+                networkValueByOptionBySection = datasetStore.buildNetwork(networkModel, networkConfiguration)
+            # If the parent network is still valid,
+            else:
+                print 'Reusing parent network'
+                networkValueByOptionBySection = networkModel.VariableStore(networkConfiguration, state=[datasetStore]).getValueByOptionBySection()
+        # Otherwise,
+        else:
+            # Register demographics
+            print 'Registering demographics'
+            store.removeSafely(parentPath)
+            sourcePath = expandPath(scenarioInput['demographic file name'])
+            datasetStore = dataset_store.create(targetPath, sourcePath, lambda x: store.pushWarning(self.id, x))
+            # Apply metric
+            print 'Applying metric'
+            metricValueByOptionBySection = datasetStore.applyMetric(metricModel, metricConfiguration, metricEngineName=metricEngineName, profiler=profiler)
+            # Build network
+            print 'Building network'
+            networkValueByOptionBySection = datasetStore.buildNetwork(networkModel, networkConfiguration)
+        nodesPath = expandPath('nodes')
+        datasetStore.saveNodesSHP(nodesPath)
+        datasetStore.saveNodesCSV(nodesPath)
         # Update metric
         print 'Updating metric'
-        metricValueByOptionBySection = datasetStore.updateMetric(metricModel, metricValueByOptionBySection)
+        metricValueByOptionBySection = datasetStore.updateMetric(metricModel, metricValueByOptionBySection, profiler)
         # Save output
         print 'Saving output'
         metric.saveMetricsCSV(expandPath('metrics-global'), metricModel, metricValueByOptionBySection)
+        if profiler:
+            metric.saveProfileCSV(expandPath('metrics-profile'), profiler)
         datasetStore.saveMetricsCSV(expandPath('metrics-local'), metricModel)
         datasetStore.saveSegmentsSHP(expandPath('networks-existing'), is_existing=True)
         datasetStore.saveSegmentsSHP(expandPath('networks-proposed'), is_existing=False)
         # Bundle
-        store.zipFolder(scenarioFolder + '.zip', scenarioFolder)
+        zipScenarioFolder(scenarioFolder)
         # Validate
         self.validateParameters()
         # Save output
         self.output = {
             'variables': { 
-                'node': dict((str(x.id), dict(input=x.input, output=x.output)) for x in datasetStore.cycleNodes()),
+                'node': dict((str(x.id), dict(input=x.input, output=variable_store.formatValueByOptionBySection(metricModel.VariableStore, x.output))) for x in datasetStore.cycleNodes()),
                 'metric': metricValueByOptionBySection,
                 'network': networkValueByOptionBySection,
             }, 
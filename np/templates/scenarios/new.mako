@@ -191,7 +191,7 @@ else:
 <% 
 from mako.template import Template
 from np import model 
-from np.lib import metric, network, variable_store
+from np.lib import metric, network, variable_store, dataset_store
 %>
 <form id=form action="${h.url('scenarios')}" enctype="multipart/form-data" method="post">
 <table> 
@@ -208,6 +208,16 @@ from np.lib import metric, network, variable_store
     </td>
     <td id=scenarioName_m></td>
 </tr>
+<tr>
+    <td>Metric engine</td>
+    <td class=value>
+        <select id=metricEngineName name=metricEngineName>
+        % for metricEngineName in dataset_store.metricEngineNames:
+            <option>${metricEngineName}</option>
+        % endfor
+        </select>
+    </td>
+</tr>
 <tr>
     <td class=option>Existing locations</td>
     <td class=value>
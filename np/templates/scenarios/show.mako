@@ -704,7 +704,7 @@ personID = h.getPersonID()
 
 <%
 from np.lib import variable_store
-variableByOptionBySection = c.metricModel.VariableStore(c.nodes[0].output).getVariableByOptionBySection()
+variableByOptionBySection = c.metricModel.VariableStore(c.nodes[0].output, isTyped=True).getVariableByOptionBySection()
 %>
 <div id=node>
 <div id=nodeName></div>
@@ -1,3 +1,10 @@
+# Import system modules
+import os
+import shutil
+import zipfile
+import tempfile
+# Import custom modules
+from np import model
 from np.tests import *
 
 class TestScenariosController(TestController):
@@ -28,3 +35,19 @@ class TestScenariosController(TestController):
 
     def test_edit(self):
         response = self.app.get(url('edit_scenario', id=1))
+
+    def test_zipScenarioFolder(self):
+        'Make sure that the download leaves out the parent dataset'
+        # Prepare
+        temporaryFolder = tempfile.mkdtemp()
+        try:
+            scenarioFolder = os.path.join(temporaryFolder, '1')
+            os.mkdir(scenarioFolder)
+            for fileName in 'dataset.db', model.parentDatasetFileName:
+                open(os.path.join(scenarioFolder, fileName), 'wb').write(fileName)
+            # Zip
+            model.zipScenarioFolder(scenarioFolder)
+            # Check
+            self.assertEqual(zipfile.ZipFile(scenarioFolder + '.zip').namelist(), ['dataset.db'])
+        finally:
+            shutil.rmtree(temporaryFolder)
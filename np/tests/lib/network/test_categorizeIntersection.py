@@ -3,6 +3,7 @@ Julian Haimovich
 Roy Hyunjin Han
 """
 # Import system modules
+import numpy
 import unittest
 import shapely.geometry as g
 # Import custom modules
@@ -34,6 +35,12 @@ class TestNetwork(unittest.TestCase):
     def verify(self, lines, line, category):
         m = g.MultiLineString([x.coords for x in lines])
         assert network.categorizeIntersection(m, line) == category
+        # Make sure that the orientation predicates agree with GEOS when they are conclusive
+        assert self.categorize(lines, line) in (None, category)
+
+    def categorize(self, lines, line):
+        segmentMatrix = numpy.array([sum(x.coords, ()) for x in lines])
+        return network.countSegmentIntersections(*network.classifySegmentIntersections(segmentMatrix, sum(line.coords, ())))
 
     def testWhenThereAreNoIntersections(self):
         # Two parallel lines do not intersect
@@ -60,3 +67,34 @@ class TestNetwork(unittest.TestCase):
         self.verify([v1, v2], s1, 2)
         # Three line segments with shared endpoint, one unique intersection
         self.verify([s3, v2], h3, 1)
+
+    def testThatOrientationPredicatesDecideCommonCases(self):
+        # Parallel lines
+        assert self.categorize([v1], v2) == 0
+        # Simple cross intersection
+        assert self.categorize([v1], h1) == 1
+        # Two unique intersections
+        assert self.categorize([v1, v2], g.LineString([(-1, 0), (2, 0)])) == 2
+        # Three line segments with shared endpoint
+        assert self.categorize([s3, v2], h3) == 1
+        # Identical segments
+        assert self.categorize([s1], s1) == 2
+        # Point on the endpoint of a segment
+        assert self.categorize([g.LineString([(1, 1), (1, 1)])], s3) == 1
+        # Endpoint inside another segment
+        assert self.categorize([v1], s1) is None
+
+    def testThatCoincidentCrossingsAreLeftToGEOS(self):
+        # Two segments cross the line at distinct points that round to the same point
+        lines = [
+            g.LineString([(0.13955245266944738, -0.17620569195603192), (1.8604475473305526, 0.8428723586226985)]),
+            g.LineString([(1.730201231481566, -0.34989880989677297), (0.2697987685184343, 1.0165654765634398)]),
+        ]
+        line = g.LineString([(0, 0), (3, 1)])
+        self.verify(lines, line, 2)
+        assert self.categorize(lines, line) is None
+        # Two segments cross each other on the line
+        lines = [g.LineString([(1, -1), (1, 1)]), g.LineString([(0, -1), (2, 1)])]
+        line = g.LineString([(-2, 0), (3, 0)])
+        self.verify(lines, line, 1)
+        assert self.categorize(lines, line) is None
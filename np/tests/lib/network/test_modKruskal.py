@@ -0,0 +1,110 @@
+'Make sure that the modified kruskal algorithm builds the same network'
+# Import system modules
+import os
+import csv
+import math
+import numpy
+import shutil
+import hashlib
+import tempfile
+import unittest
+# Import custom modules
+from np.lib import network, geometry_store, store
+from np.lib.network import modKruskal
+
+
+basePath = os.path.dirname(os.path.abspath(__file__))
+dataPath = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(basePath))), 'public', 'files')
+csvPath = os.path.join(dataPath, 'demographicsXY.csv')
+networkArchivePath = os.path.join(dataPath, 'networksXY.zip')
+# Map the metric per person to the segment count of each subnet, the total segment length and the hash of the subnet segments from the network that we built before storing budgets on subnet roots
+expectedPackByMetricPerPerson = {
+    10: ([1, 1, 1, 1, 1, 1, 1, 1, 1, 3, 5, 5, 169], 121795.561257, '4040e6d9d17705cefbfdc07ceaeb5a398d4ba9c5'),
+    50: ([1, 201], 142815.163929, '3c01dc7011e45d461091cd826eefdb5bb22312dc'),
+    200: ([203], 145444.309388, '7e176654210e88c6338670d42eba229a3a71017d'),
+}
+
+
+class DatasetNode(object):
+    'A node as loaded from a dataset'
+
+    def __init__(self, nodeID, (x, y), metric):
+        self.id = nodeID
+        self.x = x
+        self.y = y
+        self.metric = metric
+
+    def getCoordinates(self):
+        return self.x, self.y
+
+    def getCommonCoordinates(self):
+        return self.x, self.y
+
+
+class DatasetFolder(object):
+    'A dataset as seen by variables that load files relative to it'
+
+    def __init__(self, basePath):
+        self.basePath = basePath
+
+    def getBasePath(self):
+        return self.basePath
+
+
+class TestModKruskal(unittest.TestCase):
+
+    def setUp(self):
+        # Load nodes
+        csvRows = list(csv.reader(open(csvPath)))
+        self.proj4 = csvRows[0][0].replace('PROJ.4', '').strip()
+        self.nodePacks = [(float(x), float(y), float(population)) for name, x, y, population in csvRows[2:]]
+        self.temporaryFolder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temporaryFolder)
+
+    def makeNodes(self, metricPerPerson):
+        return [DatasetNode(nodeIndex + 1, (x, y), population * metricPerPerson) for nodeIndex, (x, y, population) in enumerate(self.nodePacks)]
+
+    def testThatStoringBudgetsOnSubnetRootsBuildsTheSameNetwork(self):
+        'If we store the remaining budget on the root of each subnet, then we should get the same network as when we set the weight of every node in the subnet.'
+        # For each budget,
+        for metricPerPerson, (segmentCounts, segmentLength, subnetHash) in sorted(expectedPackByMetricPerPerson.iteritems()):
+            variableStore = modKruskal.VariableStore()
+            net = variableStore.buildNetworkFromSegments(*variableStore.generateSegments(self.makeNodes(metricPerPerson), network.computeEuclideanDistance, self.proj4))
+            subnetSegments = [sorted(x.getCoordinates() for x in subnet.cycleSegments()) for subnet in net.cycleSubnets()]
+            self.assertEqual(sorted(len(x) for x in subnetSegments), segmentCounts)
+            self.assertAlmostEqual(sum(math.hypot(x1 - x2, y1 - y2) for segments in subnetSegments for (x1, y1), (x2, y2) in segments), segmentLength, places=5)
+            self.assertEqual(hashlib.sha1(repr(sorted(subnetSegments))).hexdigest(), subnetHash)
+
+    def testThatExistingNetworksBecomeASubnetOfFakeNodes(self):
+        'If we have existing networks, then each vertex should become a fake node and each transformed segment should belong to the existing subnet.'
+        # Load existing networks in a temporary folder so that unzipping leaves the source alone
+        shutil.copy(networkArchivePath, self.temporaryFolder)
+        networkProj4, networkGeometries = geometry_store.load(store.unzip(os.path.join(self.temporaryFolder, os.path.basename(networkArchivePath)), 'shp')[1])[:2]
+        coordinateTransformation = geometry_store.get_coordinateTransformation(networkProj4, self.proj4)
+        transformPoint = lambda (x, y): coordinateTransformation.TransformPoint(x, y)[:2]
+        expectedSegmentCoordinates = sorted(sorted(map(transformPoint, x)) for x in network.yieldSimplifiedCoordinatePairs(networkGeometries))
+        # Build
+        variableStore = modKruskal.VariableStore({'network': {'existing networks': os.path.basename(networkArchivePath)}}, state=[DatasetFolder(self.temporaryFolder)])
+        segments, net = variableStore.generateSegments(self.makeNodes(50), network.computeEuclideanDistance, self.proj4)
+        existingSegments = list(net.subnets[0].cycleSegments())
+        # Make sure that the batch transform matches transforming one point at a time
+        numpy.testing.assert_allclose(sorted(x.getCoordinates() for x in existingSegments), expectedSegmentCoordinates)
+        commonCoordinateTransformation = geometry_store.get_coordinateTransformation(self.proj4)
+        # Make sure that each vertex is a fake node with common coordinates
+        for segment in existingSegments:
+            self.assertTrue(segment.is_existing)
+            for node in segment.getNodes():
+                self.assertTrue(node.getID() < 0)
+                numpy.testing.assert_allclose(node.getCommonCoordinates(), commonCoordinateTransformation.TransformPoint(*node.getCoordinates())[:2])
+        # Make sure that nodes connect to the existing network
+        self.assertTrue(segments)
+        net = variableStore.buildNetworkFromSegments(segments, net)
+        existingSubnet = net.getSubnet(existingSegments[0].getNode1())
+        self.assertTrue(set(existingSegments).issubset(existingSubnet.cycleSegments()))
+        self.assertTrue(any(x.getID() > 0 for x in existingSubnet.cycleNodes()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,7 +8,7 @@ class TestNetwork(unittest.TestCase):
 
     def setUp(self):
         # Initialize
-        self.net = network.Network(network.SegmentFactory(), '+proj=utm +zone=28 +ellps=WGS84 +datum=WGS84 +units=m +no_defs')
+        self.net = network.Network(network.SegmentFactory())
 
     def verify(self, subnetCount, segmentCount):
         print '%s subnets, %s segments' % (self.net.countSubnets(), self.net.countSegments())
@@ -77,6 +77,66 @@ class TestNetwork(unittest.TestCase):
         self.net.addSegmentViaCoordinates((0, 1), (2, 0))
         self.verify(subnetCount=1, segmentCount=2)
 
+    def testThatMergedSubnetsShareTheirNodes(self):
+        'If we merge subnets, then every node should belong to the merged subnet.'
+        # Add two separate segments
+        self.net.addSegmentViaCoordinates((0, 1), (1, 0))
+        self.net.addSegmentViaCoordinates((2, 0), (3, 1))
+        getSubnet = lambda x: self.net.getSubnet(self.net.segmentFactory.getNode(x))
+        self.assertNotEqual(id(getSubnet((0, 1))), id(getSubnet((3, 1))))
+        # Connect them
+        subnet = self.net.addSegment(self.net.segmentFactory.getSegment((1, 0), (2, 0)))
+        self.verify(subnetCount=1, segmentCount=3)
+        for coordinates in (0, 1), (1, 0), (2, 0), (3, 1):
+            self.assertEqual(id(getSubnet(coordinates)), id(subnet))
+        self.assertEqual(subnet.countNodes(), 4)
+        self.assertEqual(len(subnet.multiLineString.geoms), 3)
+
+    def testThatSubnetsCanOnlyBeReplacedAsAWhole(self):
+        'If we get the subnets, then we should not be able to change them in place.'
+        self.net.addSegmentViaCoordinates((0, 1), (1, 0))
+        self.net.addSegmentViaCoordinates((2, 0), (3, 1))
+        subnets = self.net.subnets
+        self.assertEqual(len(subnets), 2)
+        self.assertFalse(hasattr(subnets, 'append'))
+        # Replace them
+        self.net.subnets = subnets[:1]
+        self.verify(subnetCount=1, segmentCount=1)
+
+    def testThatTheSegmentGridFindsSegmentsWithOverlappingBoundingBoxes(self):
+        'If we index segments, then we should find exactly those whose bounding boxes overlap the given segment.'
+        # Prepare
+        getSegment = self.net.segmentFactory.getSegment
+        segmentGrid = network.SegmentGrid(1)
+        nearSegment, farSegment, longSegment = getSegment((0, 0), (1, 1)), getSegment((5, 5), (6, 6)), getSegment((-100, 2), (100, 2))
+        for segment in nearSegment, farSegment, longSegment:
+            segmentGrid.add(segment)
+        # Make sure that we find overlapping segments, including those that cover many cells
+        self.assertEqual(list(segmentGrid.cycleOverlappingSegments(getSegment((1, 0), (1.5, 3)))), [nearSegment, longSegment])
+        self.assertEqual(list(segmentGrid.cycleOverlappingSegments(getSegment((3, 3), (4, 4)))), [])
+
+    def testThatTheSegmentGridVisitsOnlyOccupiedCellsForLongSegments(self):
+        'If a segment covers many cells, then we should find overlapping segments without visiting every cell.'
+        # Prepare
+        getSegment = self.net.segmentFactory.getSegment
+        segmentGrid = network.SegmentGrid(1)
+        segments = [getSegment((500, 400), (501, 401)), getSegment((1, 1), (2, 2)), getSegment((9000, 9999), (9001, 10000)), getSegment((-50, -50), (-49, -49))]
+        for segment in segments:
+            segmentGrid.add(segment)
+        # Make sure that a long diagonal segment finds segments in the same order as a short one
+        self.assertEqual(list(segmentGrid.cycleOverlappingSegments(getSegment((0, 0), (10000, 10000)))), [segments[1], segments[0], segments[2]])
+        self.assertEqual(list(segmentGrid.cycleOverlappingSegments(getSegment((1.5, 1.5), (500.5, 400.5)))), [segments[1], segments[0]])
+
+    def testThatASegmentCrossingTwoSegmentsOfASubnetIsIgnored(self):
+        'If a segment crosses the same subnet twice, then we should ignore it even if the subnet is large.'
+        # Add a long segment and a short segment that connects to it
+        self.net.addSegmentViaCoordinates((-100, 0), (100, 0))
+        self.net.addSegmentViaCoordinates((0, 0), (0, 2))
+        self.verify(subnetCount=1, segmentCount=2)
+        # Add a segment that crosses both segments
+        self.net.addSegmentViaCoordinates((1, -1), (-1, 1.5))
+        self.verify(subnetCount=1, segmentCount=2)
+
 
 if __name__ == '__main__':
     unittest.main()
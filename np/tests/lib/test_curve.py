@@ -1,5 +1,7 @@
 'Make sure that we can fit curves properly'
 # Import system modules
+import numpy
+import pickle
 import unittest
 # Import custom modules
 from np.lib import curve
@@ -20,3 +22,63 @@ class TestCurve(unittest.TestCase):
         # Make sure that we are getting the same exact curve
         self.assertNotEqual(id(c1), id(c2))
         self.assertEqual(id(c1), id(c3))
+
+    def test_curveCacheIsBounded(self):
+        'Ensure that the curve cache forgets the least recently used curve and counts hits and misses'
+        # Prepare
+        curveCacheSize = curve.curveCacheSize
+        curve.curveCacheSize = 2
+        curve.curveCache.clear()
+        try:
+            countByName = curve.getCacheCounts()
+            c1 = curve.fit('ZeroLinear', ((0, 1), (1, 2)))
+            curve.fit('ZeroLinear', ((0, 1), (1, 3)))
+            self.assertTrue(curve.fit('ZeroLinear', ((0, 1), (1, 2))) is c1)
+            curve.fit('ZeroLinear', ((0, 1), (1, 4)))
+            # Make sure that we kept the most recently used curves
+            self.assertEqual(len(curve.curveCache), 2)
+            self.assertTrue(curve.fit('ZeroLinear', ((0, 1), (1, 2))) is c1)
+            self.assertEqual(curve.getCacheCounts()['hits'] - countByName['hits'], 2)
+            self.assertEqual(curve.getCacheCounts()['misses'] - countByName['misses'], 3)
+        finally:
+            curve.curveCacheSize = curveCacheSize
+
+    def test_interpolateArray(self):
+        'Ensure that interpolating an array matches interpolating each value'
+        xs = numpy.array([-1, 0, 0.5, 10, 99.9, 100, 1000, 5000])
+        # For each curve type,
+        for curveType in curve.curveTypes:
+            c = curve.fit(curveType, ((10, 100, 1000), (1, 5, 7)))
+            self.assertEqual(c.interpolate(xs).tolist(), [c.interpolate(x) for x in xs])
+
+    def test_curvePickling(self):
+        'Ensure that pickled curves load as a single shared curve that interpolates and formats the same way'
+        # Prepare
+        c1 = curve.fit('ZeroLogisticLinear', ((10, 100, 1000), (1, 5, 7)))
+        c2, c3 = pickle.loads(pickle.dumps([c1, c1]))
+        c4 = pickle.loads(pickle.dumps(c1))
+        # Make sure that copies share a curve
+        self.assertEqual(id(c2), id(c3))
+        self.assertEqual(id(c2), id(c4))
+        self.assertEqual([c1.interpolate(x) for x in (0, 50, 5000)], [c2.interpolate(x) for x in (0, 50, 5000)])
+        self.assertEqual(curve.format(c1), curve.format(c2))
+        # Make sure that we remember the string for each curve
+        self.assertTrue(curve.format(c1) is curve.format(c1))
+
+    def test_curveApproximation(self):
+        'Ensure that lookup tables stay within the maximum error and leave formatted curves unchanged'
+        # Prepare
+        xs = numpy.linspace(0, 5000, 1001)
+        curve.approximationError = 0.0001
+        try:
+            # For each curve type,
+            for curveType in curve.curveTypes:
+                c = curve.fit(curveType, ((10, 100, 10000), (1, 5, 7)))
+                ys = c.interpolate(xs)
+                curveText = curve.format(c)
+                # Make sure that we stay within the maximum error
+                for x, y in zip(xs, ys):
+                    self.assertTrue(abs(c.interpolate(x) - y) <= curve.approximationError)
+                self.assertEqual(curve.format(c), curveText)
+        finally:
+            curve.approximationError = None
@@ -1,9 +1,12 @@
 'Make sure that we can load datasets properly'
 # Import system modules
 import unittest
+import tempfile
+import shutil
 import os
+import sqlalchemy as sa
 # Import custom modules
-from np.lib import dataset_store
+from np.lib import dataset_store, geometry_store, metric, network
 
 
 basePath = os.path.dirname(os.path.abspath(__file__))
@@ -15,6 +18,26 @@ zipPath = os.path.join(dataPath, 'demographicsXY.zip')
 class TestDatasetStore(unittest.TestCase):
     'Test dataset_store functions'
 
+    def setUp(self):
+        self.temporaryFolder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temporaryFolder)
+
+    def makeDataset(self, nodeCount):
+        'Make a dataset with nodes along the x-axis'
+        dataset = dataset_store.Store(os.path.join(self.temporaryFolder, 'dataset.db'), geometry_store.proj4LL)
+        dataset.addNodes([dict(x=str(x), y='0', population='100') for x in xrange(nodeCount)])
+        return dataset
+
+    def runDataset(self, datasetName, metricModel, metricValueByOptionBySection, networkModel, networkValueByOptionBySection):
+        'Make a dataset with clustered nodes, apply the metric and build the network in the same way as a scenario'
+        dataset = dataset_store.Store(os.path.join(self.temporaryFolder, datasetName), geometry_store.proj4LL)
+        dataset.addNodes([dict(x=str(0.2 * x), y=str(0.1 * (x % 2)), population='500') for x in xrange(8)])
+        metricValueByOptionBySection = dataset.applyMetric(metricModel, metricValueByOptionBySection)
+        dataset.buildNetwork(networkModel, networkValueByOptionBySection)
+        return dataset, dataset.updateMetric(metricModel, metricValueByOptionBySection)
+
     def assertDigest(self, digest, datasetPath):
         # For each row,
         for attributeByName in digest(datasetPath)[1]:
@@ -27,3 +50,269 @@ class TestDatasetStore(unittest.TestCase):
 
     def test_digestNodesFromZIP(self):
         return self.assertDigest(dataset_store.digestNodesFromZIP, zipPath)
+
+    def test_yieldNodeOutputPacks(self):
+        'Ensure that node outputs are flattened into typed rows'
+        nodeValuePacks = list(dataset_store.yieldNodeOutputPacks(1, {'metric': {'system': 'grid', 'maximum length of medium voltage line extension': '125.5'}}))
+        numberByOption = dict((x['option'], x['number']) for x in nodeValuePacks)
+        textByOption = dict((x['option'], x['text']) for x in nodeValuePacks)
+        self.assertEqual(numberByOption['system'], None)
+        self.assertEqual(numberByOption['maximum length of medium voltage line extension'], 125.5)
+        self.assertEqual(textByOption['system'], u'grid')
+
+    def test_cycleConnections(self):
+        'Ensure that connection lookups use the segment index'
+        # Prepare
+        dataset = self.makeDataset(3)
+        node1, node2, node3 = dataset.cycleNodes()
+        for nodeA, nodeB, is_existing in [(node1, node2, True), (node2, node3, False)]:
+            segment = dataset_store.Segment(nodeA.id, nodeB.id)
+            segment.is_existing = is_existing
+            segment.weight = 1
+            dataset.session.add(segment)
+        dataset.session.commit()
+        dataset.indexConnections()
+        # Check
+        self.assertTrue(dataset.isNodeConnected(node3))
+        self.assertTrue(dataset.wasNodeAlreadyConnected(node1))
+        self.assertFalse(dataset.wasNodeAlreadyConnected(node3))
+        self.assertEqual(len(list(dataset.cycleConnections(node2))), 2)
+        self.assertEqual(len(list(dataset.cycleConnections(node2, is_existing=False))), 1)
+
+    def test_saveNetwork(self):
+        'Ensure that a failure while saving the network leaves nothing behind'
+        # Prepare
+        metricModel = metric.getModel('mvMax3')
+        networkModel = network.getModel('modKruskal')
+        networkValueByOptionBySection = networkModel.VariableStore().getValueByOptionBySection()
+        metricValueByOptionBySection = metricModel.VariableStore({'demand (household)': {'household unit demand per household per year': '1000'}, 'finance': {'time horizon': '20'}}).getValueByOptionBySection()
+        dataset = self.runDataset('dataset.db', metricModel, metricValueByOptionBySection, networkModel, networkValueByOptionBySection)[0]
+        segmentCount = dataset.session.query(dataset_store.Segment).count()
+        subnetCount = dataset.session.query(dataset_store.Subnet).count()
+        self.assertTrue(segmentCount)
+        dataset.removeNetwork()
+        net = networkModel.VariableStore(networkValueByOptionBySection, state=[dataset]).buildNetworkFromNodes(list(dataset.cycleNodes()), dataset.getProj4())
+        # Fail after inserting subnets
+        insertRows = dataset.insertRows
+        def insertRowsThenFail(table, rows):
+            insertRows(table, rows)
+            if table is dataset_store.segments_table:
+                raise IOError('Disk full')
+        dataset.insertRows = insertRowsThenFail
+        self.assertRaises(IOError, dataset.saveNetwork, net)
+        dataset.session.rollback()
+        self.assertEqual(dataset.session.query(dataset_store.Subnet).count(), 0)
+        self.assertEqual(dataset.session.query(dataset_store.Segment).count(), 0)
+        # Make sure that saving again stores the whole network
+        del dataset.insertRows
+        dataset.saveNetwork(net)
+        self.assertEqual(dataset.session.query(dataset_store.Subnet).count(), subnetCount)
+        self.assertEqual(dataset.session.query(dataset_store.Segment).count(), segmentCount)
+
+    def test_removeDuplicateNodes(self):
+        'Ensure that we keep the first node at each location and report duplicates'
+        # Prepare
+        warnings = []
+        dataset = dataset_store.Store(os.path.join(self.temporaryFolder, 'dataset.db'), geometry_store.proj4LL)
+        dataset.addNodes([dict(x='0', y='0', name='a'), dict(x='1', y='0', name='b'), dict(x='0', y='0', name='c')], warnings.append)
+        # Check
+        self.assertEqual(dataset.countNodes(), 2)
+        self.assertEqual(sorted(x.input['name'] for x in dataset.cycleNodes()), ['a', 'b'])
+        self.assertEqual(len(warnings), 1)
+
+    def test_applyMetricWithWorkers(self):
+        'Ensure that a pool of workers gives the same outputs as a single process and restores the journal mode'
+        # Prepare
+        dataset = self.makeDataset(5)
+        metricModel = metric.getModel('mvMax3')
+        metricValueByOptionBySection = metricModel.VariableStore({'demand (household)': {'household unit demand per household per year': '1000'}}).getValueByOptionBySection()
+        metricOutputs = dataset.applyMetric(metricModel, metricValueByOptionBySection, workerCount=1)
+        nodePacks = [(x.id, x.metric, x.output) for x in dataset.cycleNodes()]
+        # Split nodes into several chunks
+        metricChunkSize = dataset_store.metricChunkSize
+        dataset_store.metricChunkSize = 2
+        try:
+            pooledMetricOutputs = dataset.applyMetric(metricModel, metricValueByOptionBySection, workerCount=2)
+        finally:
+            dataset_store.metricChunkSize = metricChunkSize
+        # Check
+        self.assertEqual(pooledMetricOutputs, metricOutputs)
+        self.assertEqual([(x.id, x.metric, x.output) for x in dataset.cycleNodes()], nodePacks)
+        self.assertEqual(dataset.session.execute('PRAGMA journal_mode').scalar(), 'delete')
+
+    def test_prepareMetricJob(self):
+        'Ensure that hoisting does not add computed values to the job-level configuration'
+        # Prepare
+        dataset = self.makeDataset(4)
+        metricModel = metric.getModel('mvMax3')
+        metricValueByOptionBySection = metricModel.VariableStore({'finance': {'time horizon': '20'}}).getValueByOptionBySection()
+        # For each metric engine,
+        for metricEngineName in dataset_store.metricEngineNames:
+            jobVS = dataset.prepareMetricJob(metricModel, metricValueByOptionBySection, metricEngineName)
+            # Check
+            self.assertTrue(dataset.metricStatistics['hoisted variable count'])
+            self.assertEqual(jobVS.getValueByOptionBySection(), dataset_store.makeMetricJob(metricModel, metricValueByOptionBySection, metricEngineName).getValueByOptionBySection())
+
+    def test_reapplyMetric(self):
+        'Ensure that recomputing affected variables returns the same job-level outputs as a full run'
+        # Prepare
+        dataset = self.makeDataset(4)
+        metricModel = metric.getModel('mvMax3')
+        parentMetricValueByOptionBySection = metricModel.VariableStore().getValueByOptionBySection()
+        metricValueByOptionBySection = metricModel.VariableStore({'finance': {'time horizon': '20'}}).getValueByOptionBySection()
+        dataset.applyMetric(metricModel, parentMetricValueByOptionBySection)
+        # Check
+        reappliedValueByOptionBySection = dataset.reapplyMetric(metricModel, metricValueByOptionBySection, parentMetricValueByOptionBySection)[0]
+        self.assertTrue(dataset.metricStatistics['hoisted variable count'])
+        self.assertEqual(dataset.metricStatistics['changed parameter count'], 1)
+        self.assertEqual(reappliedValueByOptionBySection, dataset.applyMetric(metricModel, metricValueByOptionBySection))
+
+    def test_reapplyMetricOnNetwork(self):
+        'Ensure that reusing a parent dataset gives the same node and job outputs as a full run'
+        # Prepare
+        metricModel = metric.getModel('mvMax3')
+        networkModel = network.getModel('modKruskal')
+        networkValueByOptionBySection = networkModel.VariableStore().getValueByOptionBySection()
+        demandValueByOption = {'household unit demand per household per year': '1000'}
+        parentMetricValueByOptionBySection = metricModel.VariableStore({'demand (household)': demandValueByOption, 'finance': {'time horizon': '5'}}).getValueByOptionBySection()
+        metricValueByOptionBySection = metricModel.VariableStore({'demand (household)': demandValueByOption, 'finance': {'time horizon': '20'}}).getValueByOptionBySection()
+        parentDataset = self.runDataset('parent.db', metricModel, parentMetricValueByOptionBySection, networkModel, networkValueByOptionBySection)[0]
+        dataset, metricOutputs = self.runDataset('full.db', metricModel, metricValueByOptionBySection, networkModel, networkValueByOptionBySection)
+        # Make sure that the change in configuration changes the network
+        self.assertFalse(parentDataset.session.query(dataset_store.Segment).count())
+        self.assertTrue(dataset.session.query(dataset_store.Segment).count())
+        # For each metric engine,
+        for metricEngineName in dataset_store.metricEngineNames:
+            # Reuse the parent dataset
+            datasetPath = os.path.join(self.temporaryFolder, '%s.db' % metricEngineName)
+            shutil.copyfile(parentDataset.getDatasetPath(), datasetPath)
+            reusedDataset = dataset_store.Store(datasetPath)
+            reusedMetricOutputs, isMetricChanged = reusedDataset.reapplyMetric(metricModel, metricValueByOptionBySection, parentMetricValueByOptionBySection, metricEngineName)
+            if isMetricChanged:
+                reusedDataset.removeNetwork()
+                reusedDataset.buildNetwork(networkModel, networkValueByOptionBySection)
+            reusedMetricOutputs = reusedDataset.updateMetric(metricModel, reusedMetricOutputs)
+            # Check
+            self.assertTrue(isMetricChanged)
+            self.assertEqual(reusedMetricOutputs, metricOutputs)
+            self.assertEqual([(x.id, x.metric, x.output) for x in reusedDataset.cycleNodes()], [(x.id, x.metric, x.output) for x in dataset.cycleNodes()])
+
+    def test_sweepMetric(self):
+        'Ensure that a parameter sweep returns a row of system counts and totals for each value'
+        # Prepare
+        metricModel = metric.getModel('mvMax3')
+        networkModel = network.getModel('modKruskal')
+        networkValueByOptionBySection = networkModel.VariableStore().getValueByOptionBySection()
+        metricValueByOptionBySection = metricModel.VariableStore({'demand (household)': {'household unit demand per household per year': '1000'}, 'finance': {'time horizon': '5'}}).getValueByOptionBySection()
+        dataset = self.runDataset('base.db', metricModel, metricValueByOptionBySection, networkModel, networkValueByOptionBySection)[0]
+        # Sweep
+        sweepHeaders, sweepRows = dataset.sweepMetric(metricModel, metricValueByOptionBySection, 'finance > time horizon', ['5', '20'], networkModel, networkValueByOptionBySection, workerCount=1)
+        # Check
+        self.assertEqual([x[0] for x in sweepRows], ['5', '20'])
+        countIndices = [index for index, header in enumerate(sweepHeaders) if header.endswith(' count')]
+        for sweepRow in sweepRows:
+            self.assertEqual(len(sweepRow), len(sweepHeaders))
+            self.assertEqual(sum(sweepRow[x] for x in countIndices), 8)
+        self.assertEqual(sweepRows[1][sweepHeaders.index('grid count')], 8)
+        self.assertTrue(sweepRows[1][sweepHeaders.index('system (grid) > system total discounted cost')])
+        # Make sure that we refuse unknown parameters, stale networks and node outputs from another configuration
+        self.assertRaises(dataset_store.DatasetError, dataset.sweepMetric, metricModel, metricValueByOptionBySection, 'finance > unknown', ['1'])
+        self.assertRaises(dataset_store.DatasetError, dataset.sweepMetric, metricModel, metricValueByOptionBySection, 'finance > time horizon', ['20'], workerCount=1)
+        self.assertEqual(os.listdir(self.temporaryFolder), ['base.db'])
+        self.assertRaises(dataset_store.DatasetError, dataset.sweepMetric, metricModel, metricModel.VariableStore().getValueByOptionBySection(), 'finance > time horizon', ['20'], networkModel, networkValueByOptionBySection, workerCount=1)
+        # Make sure that we refuse datasets where we have not chosen systems
+        dataset = self.makeDataset(4)
+        dataset.applyMetric(metricModel, metricValueByOptionBySection)
+        self.assertRaises(dataset_store.DatasetError, dataset.sweepMetric, metricModel, metricValueByOptionBySection, 'finance > time horizon', ['20'], networkModel, networkValueByOptionBySection, workerCount=1)
+
+
+class TestDatasetSettings(unittest.TestCase):
+    'Test dataset settings, pragmas and the dataset cache'
+
+    def setUp(self):
+        self.temporaryFolder = tempfile.mkdtemp()
+        self.settingPack = dataset_store.defaultPragmas[:], dataset_store.runPragmas[:], dataset_store.datasetCacheSize, dataset_store.metricWorkerCount, dataset_store.isMetricProfiled
+
+    def tearDown(self):
+        # Restore settings
+        defaultPragmas, runPragmas, dataset_store.datasetCacheSize, dataset_store.metricWorkerCount, dataset_store.isMetricProfiled = self.settingPack
+        dataset_store.defaultPragmas[:] = defaultPragmas
+        dataset_store.runPragmas[:] = runPragmas
+        # Release cached datasets
+        for datasetPath in list(dataset_store.datasetCache):
+            dataset_store.forgetCached(datasetPath)
+        shutil.rmtree(self.temporaryFolder)
+
+    def makeDataset(self, datasetName, nodeCount=2):
+        'Make a dataset and close it'
+        datasetPath = os.path.join(self.temporaryFolder, datasetName)
+        dataset = dataset_store.Store(datasetPath, geometry_store.proj4LL)
+        dataset.addNodes([dict(x=str(x), y='0') for x in xrange(nodeCount)])
+        dataset.close()
+        return datasetPath
+
+    def test_parsePragmas(self):
+        self.assertEqual(dataset_store.parsePragmas('journal_mode=WAL  cache_size=-8000'), [('journal_mode', 'WAL'), ('cache_size', '-8000')])
+        self.assertEqual(dataset_store.parsePragmas(''), [])
+        self.assertRaises(dataset_store.DatasetError, dataset_store.parsePragmas, 'journal_mode')
+        self.assertRaises(dataset_store.DatasetError, dataset_store.parsePragmas, 'journal_mode=WAL;')
+
+    def test_configure(self):
+        dataset_store.configure({
+            'dataset.pragmas': 'cache_size=-4000',
+            'dataset.run_pragmas': 'synchronous=OFF',
+            'dataset.cache_size': '3',
+            'dataset.metric_worker_count': '2',
+            'dataset.metric_profile': 'yes',
+        })
+        self.assertEqual(dataset_store.defaultPragmas, [('cache_size', '-4000')])
+        self.assertEqual(dataset_store.runPragmas, [('synchronous', 'OFF')])
+        self.assertEqual((dataset_store.datasetCacheSize, dataset_store.metricWorkerCount, dataset_store.isMetricProfiled), (3, 2, True))
+        # Make sure that missing settings keep their values
+        dataset_store.configure({})
+        self.assertEqual(dataset_store.defaultPragmas, [])
+        self.assertEqual(dataset_store.datasetCacheSize, 3)
+
+    def test_PragmaListener(self):
+        'Ensure that every connection runs the default pragmas followed by the given pragmas'
+        dataset_store.defaultPragmas[:] = [('cache_size', '-4000')]
+        dataset = dataset_store.Store(self.makeDataset('dataset.db'), pragmas=[('synchronous', 'OFF')])
+        self.assertEqual(dataset.session.execute('PRAGMA cache_size').scalar(), -4000)
+        self.assertEqual(dataset.session.execute('PRAGMA synchronous').scalar(), 0)
+        dataset.close()
+        # Make sure that read-only datasets refuse to write
+        dataset = dataset_store.Store(self.makeDataset('dataset.db'), isReadOnly=True)
+        self.assertEqual(dataset.countNodes(), 2)
+        self.assertRaises(sa.exc.OperationalError, dataset.session.execute, dataset_store.nodes_table.delete())
+        dataset.close()
+
+    def test_loadCached(self):
+        'Ensure that the cache reuses datasets until they change, are forgotten or are evicted'
+        dataset_store.datasetCacheSize = 1
+        datasetPath = self.makeDataset('dataset.db')
+        # Make sure that we reuse the dataset
+        dataset = dataset_store.loadCached(datasetPath)
+        self.assertTrue(dataset.isReadOnly)
+        self.assertTrue(dataset_store.loadCached(datasetPath) is dataset)
+        # Make sure that we reopen the dataset after forgetting it, as when a scenario runs again
+        dataset_store.forgetCached(datasetPath)
+        self.assertFalse(datasetPath in dataset_store.datasetCache)
+        newDataset = dataset_store.loadCached(datasetPath)
+        self.assertFalse(newDataset is dataset)
+        # Make sure that we reopen the dataset after it changes
+        dataset = newDataset
+        os.remove(datasetPath)
+        datasetPath = self.makeDataset('dataset.db', 3)
+        newDataset = dataset_store.loadCached(datasetPath)
+        self.assertFalse(newDataset is dataset)
+        self.assertEqual(newDataset.countNodes(), 3)
+        # Make sure that we evict the least recently used dataset
+        dataset_store.loadCached(self.makeDataset('other.db'))
+        self.assertEqual(dataset_store.datasetCache.keys(), [os.path.join(self.temporaryFolder, 'other.db')])
+        # Make sure that we fill node values for datasets that predate them
+        datasetPath = self.makeDataset('legacy.db')
+        dataset = dataset_store.Store(datasetPath)
+        dataset.session.execute('DROP TABLE node_values')
+        dataset.session.commit()
+        dataset.close()
+        self.assertTrue(dataset_store.loadCached(datasetPath).hasNodeValues())
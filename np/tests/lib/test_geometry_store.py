@@ -105,13 +105,21 @@ class TestGeometryStore(unittest.TestCase):
         transform_point1 = geometry_store.get_transform_point(geometry_store.proj4LL, geometry_store.proj4SM)
         self.assertNotEqual(transform_point0(0, 0), transform_point1(0, 0))
 
+        print 'Test get_transform_points'
+        transform_points = geometry_store.get_transform_points(geometry_store.proj4LL, geometry_store.proj4SM)
+        xys = transform_points([(0, 0), (10, 10)])
+        self.assertEqual(xys.shape, (2, 2))
+        self.assertEqual(tuple(xys[1]), transform_point1(10, 10))
+        self.assertEqual(transform_points([]).shape, (0, 2))
+
         print 'Test get_transform_geometry'
         transform_geometry = geometry_store.get_transform_geometry(geometry_store.proj4LL, geometry_store.proj4SM)
         self.assertEqual(type(transform_geometry(geometry.Point(0, 0))), type(geometry.Point(0, 0)))
         self.assertEqual(type(transform_geometry(ogr.CreateGeometryFromWkt('POINT (0 0)'))), type(ogr.CreateGeometryFromWkt('POINT (0 0)')))
 
         print 'Test get_coordinateTransformation'
-        geometry_store.get_coordinateTransformation(geometry_store.proj4LL, geometry_store.proj4SM)
+        coordinateTransformation = geometry_store.get_coordinateTransformation(geometry_store.proj4LL, geometry_store.proj4SM)
+        self.assertEqual(id(coordinateTransformation), id(geometry_store.get_coordinateTransformation(geometry_store.proj4LL, geometry_store.proj4SM)))
 
         print 'Test get_spatialReference'
         geometry_store.get_spatialReference(geometry_store.proj4LL)
@@ -2,7 +2,7 @@
 # Import system modules
 import unittest
 # Import custom modules
-from np.lib import variable_store
+from np.lib import variable_store, metric
 
 
 class TestVariableStore(unittest.TestCase):
@@ -55,11 +55,164 @@ class TestVariableStore(unittest.TestCase):
         c4 = id(childStore.get(ComplexVariable))
         self.assertNotEqual(c1, c4)
 
+    def testCompilingModelIndexesVariablesOncePerClass(self):
+        VariableStore()
+        variableClassByAlias = VariableStore.variableClassByAlias
+        VariableStore({'simple': {'variable': '4'}})
+        self.assertTrue(VariableStore.variableClassByAlias is variableClassByAlias)
+        self.assertEqual(VariableStore.variableClassesBySection['complex']['variable'], ComplexVariable)
+
+    def testDependencyClosureIncludesIndirectDependencies(self):
+        VariableStore.compileModel()
+        self.assertEqual(VariableStore.dependencyClosureByClass[NestedVariable], frozenset([ComplexVariable, SimpleVariable]))
+        self.assertEqual(VariableStore.dependencyClosureByClass[SimpleVariable], frozenset())
+
+    def testAliasesOverrideSections(self):
+        variableStore = VariableStore({'simple': {'variable': '4'}, 'sv': '7'})
+        self.assertEqual(variableStore.get(SimpleVariable), 7)
+
+    def testChangingParameterAffectsOnlyDerivatives(self):
+        changedClasses = variable_store.getChangedVariableClasses(VariableStore, {'complex': {'variable': '5'}}, {'complex': {'variable': '6'}})
+        self.assertEqual(changedClasses, set([ComplexVariable]))
+        self.assertEqual(variable_store.getAffectedVariableClasses(VariableStore, changedClasses), set([ComplexVariable, NestedVariable]))
+
+    def testRecomputingFromStoredOutputsMatchesFullEvaluation(self):
+        parentStore = VariableStore({'simple': {'variable': '3'}})
+        storedOutput = VariableStore(variableStore=parentStore).getValueByOptionBySection()
+        # Keep only the outputs that do not depend on the changed parameter
+        parentStore = VariableStore({'simple': {'variable': '5'}})
+        affectedKeys = set((x.section, x.option) for x in variable_store.getAffectedVariableClasses(VariableStore, [SimpleVariable]))
+        childStore = VariableStore(dict((section, dict((option, value) for option, value in valueByOption.iteritems() if (section, option) not in affectedKeys)) for section, valueByOption in storedOutput.iteritems()), parentStore)
+        self.assertEqual(childStore.get(NestedVariable), 100)
+
+    def testVariablesDependingOnOverridesAreNotInvariant(self):
+        self.assertEqual(variable_store.getInvariantVariableClasses(VariableStore, [ComplexVariable]), [SimpleVariable])
+        self.assertEqual(variable_store.getInvariantVariableClasses(VariableStore, [SimpleVariable]), [])
+
+    def testHoistingKeepsNodeValues(self):
+        nodeValuePacks = [{'pop': str(x)} for x in xrange(0, 3000, 300)]
+        # For each metric model,
+        for metricModelName in metric.getModelNames():
+            metricModel = metric.getModel(metricModelName)
+            modelClass = metricModel.VariableStore
+            jobVS = modelClass()
+            hoistedVS = modelClass()
+            hoistedClasses = hoistedVS.hoistVariables(variable_store.getInvariantVariableClasses(modelClass, [metricModel.demographics.PopulationCount]))
+            self.assertTrue(hoistedClasses)
+            self.assertFalse(hoistedClasses.intersection(variable_store.getAffectedVariableClasses(modelClass, [metricModel.demographics.PopulationCount])))
+            # Make sure that nodes get the same values
+            for nodeValueByOptionBySection in nodeValuePacks:
+                nodeVS = jobVS.makeChild(nodeValueByOptionBySection)
+                hoistedNodeVS = hoistedVS.makeChild(nodeValueByOptionBySection)
+                self.assertEqual(nodeVS.get(metricModel.Metric), hoistedNodeVS.get(metricModel.Metric))
+                valueByOptionBySection = hoistedNodeVS.getValueByOptionBySection()
+                for section, valueByOption in nodeVS.getValueByOptionBySection().iteritems():
+                    for option, value in valueByOption.iteritems():
+                        self.assertEqual(value, valueByOptionBySection[section][option])
+
+    def testHoistingLeavesConfigurationUnchanged(self):
+        # For each metric model,
+        for metricModelName in metric.getModelNames():
+            metricModel = metric.getModel(metricModelName)
+            modelClass = metricModel.VariableStore
+            invariantClasses = variable_store.getInvariantVariableClasses(modelClass, [metricModel.demographics.PopulationCount])
+            for makeJob in modelClass, lambda x: variable_store.VariableEvaluator(modelClass, x):
+                jobVS = makeJob({'finance': {'time horizon': '15'}})
+                hoistedVS = makeJob({'finance': {'time horizon': '15'}})
+                self.assertTrue(hoistedVS.hoistVariables(invariantClasses))
+                # Make sure that hoisted values are not returned as configuration
+                self.assertEqual(hoistedVS.getValueByOptionBySection(), jobVS.getValueByOptionBySection())
+                self.assertEqual(hoistedVS.getTypedValueByOptionBySection(), jobVS.getTypedValueByOptionBySection())
+
+    def testHoistingLeavesOnlyVariablesThatNeedNodeState(self):
+        for jobVS in StateVariableStore(state=['dataset']), variable_store.VariableEvaluator(StateVariableStore, state=['dataset']):
+            self.assertEqual(jobVS.hoistVariables([SimpleVariable, NodeStateVariable]), frozenset([SimpleVariable]))
+            self.assertEqual(jobVS.makeChild({'sv': '3'}, ['dataset', 'node']).get(NodeStateVariable), 'node')
+            # Make sure that other errors are not mistaken for node-level dependencies
+            self.assertRaises(ZeroDivisionError, jobVS.hoistVariables, [BrokenVariable])
+
+    def testTypedValuesRoundTripWithoutParsing(self):
+        # For each metric model,
+        for metricModelName in metric.getModelNames():
+            metricModel = metric.getModel(metricModelName)
+            nodeVS = metricModel.VariableStore({'pop': '750'}, metricModel.VariableStore())
+            nodeVS.get(metricModel.Metric)
+            typedValueByOptionBySection = nodeVS.getTypedValueByOptionBySection()
+            # Make sure that formatting typed values matches formatting inside the store
+            self.assertEqual(variable_store.formatValueByOptionBySection(metricModel.VariableStore, typedValueByOptionBySection), nodeVS.getValueByOptionBySection())
+            # Make sure that restoring typed values keeps them as they are
+            restoredVS = metricModel.VariableStore(typedValueByOptionBySection, isTyped=True)
+            self.assertEqual(restoredVS.getTypedValueByOptionBySection(), typedValueByOptionBySection)
+            self.assertEqual(restoredVS.get(metricModel.Metric), nodeVS.get(metricModel.Metric))
+        # Make sure that text is still parsed
+        self.assertEqual(VariableStore({'simple': {'variable': '5'}}, isTyped=True).get(SimpleVariable), 5)
+
+    def testProfilerCountsComputationsHitsAndLookups(self):
+        profiler = variable_store.VariableProfiler()
+        profiledStoreClass = profiler.wrap(VariableStore)
+        jobStore = profiledStoreClass({'simple': {'variable': '3'}})
+        for value in '4', None:
+            nodeStore = jobStore.makeChild({'sv': value} if value else {})
+            nodeStore.get(NestedVariable)
+            nodeStore.get(NestedVariable)
+        # Make sure that the original class is untouched
+        self.assertFalse(issubclass(VariableStore, profiledStoreClass))
+        statistic = profiler.statisticByClass[NestedVariable]
+        self.assertEqual((statistic.computeCount, statistic.hitCount, statistic.lookupCount, statistic.lookupDepthMaximum), (2, 2, 1, 1))
+
+
+class TestVariableEvaluator(unittest.TestCase):
+    'Make sure that the evaluator matches VariableStore'
+
+    nodeValuePacks = [
+        {},
+        {'pop': ''},
+        {'simple': {'variable': '4'}},
+        {'nested': {'variable': '7'}},
+    ]
+
+    def assertParity(self, modelClass, metricClass, valueByOptionBySection, nodeValuePacks, invariantClasses=()):
+        # Prepare
+        jobVS = modelClass(valueByOptionBySection)
+        evaluator = variable_store.VariableEvaluator(modelClass, valueByOptionBySection)
+        self.assertEqual(jobVS.hoistVariables(invariantClasses), evaluator.hoistVariables(invariantClasses))
+        # For each node,
+        for nodeValueByOptionBySection in nodeValuePacks:
+            nodeVS = jobVS.makeChild(nodeValueByOptionBySection)
+            nodeContext = evaluator.makeChild(nodeValueByOptionBySection)
+            self.assertEqual(nodeVS.get(metricClass), nodeContext.get(metricClass))
+            self.assertEqual(nodeVS.getValueByOptionBySection(), nodeContext.getValueByOptionBySection())
+            self.assertEqual(nodeVS.getTypedValueByOptionBySection(), nodeContext.getTypedValueByOptionBySection())
+        # Make sure that job-level values match
+        self.assertEqual(jobVS.getValueByOptionBySection(), evaluator.getValueByOptionBySection())
+
+    def testEvaluatorMatchesVariableStore(self):
+        self.assertParity(VariableStore, NestedVariable, {'simple': {'variable': '3'}}, self.nodeValuePacks)
+
+    def testEvaluatorMatchesShippedModels(self):
+        nodeValuePacks = [{'pop': str(x)} for x in xrange(0, 3000, 150)] + [
+            {'pop': '500', 'finance': {'interest rate per year': '0.2'}},
+            {'demographics': {'population count': '800'}, 'finance': {'time horizon': '20'}},
+            {'pop': ''},
+        ]
+        # For each metric model,
+        for metricModelName in metric.getModelNames():
+            metricModel = metric.getModel(metricModelName)
+            self.assertParity(metricModel.VariableStore, metricModel.Metric, {'finance': {'time horizon': '15'}}, nodeValuePacks)
+
+    def testEvaluatorMatchesHoistedVariableStore(self):
+        nodeValuePacks = [{'pop': str(x)} for x in xrange(0, 3000, 150)] + [{'pop': ''}, {}]
+        # For each metric model,
+        for metricModelName in metric.getModelNames():
+            metricModel = metric.getModel(metricModelName)
+            invariantClasses = variable_store.getInvariantVariableClasses(metricModel.VariableStore, [metricModel.demographics.PopulationCount])
+            self.assertParity(metricModel.VariableStore, metricModel.Metric, {}, nodeValuePacks, invariantClasses=invariantClasses)
 
 class SimpleVariable(variable_store.Variable):
 
     section = 'simple'
     option = 'variable'
+    aliases = ['sv']
     c = dict(parse=int)
     default = 2
 
@@ -97,3 +250,37 @@ class VariableStore(variable_store.VariableStore):
         ComplexVariable,
         NestedVariable,
     ]
+
+
+class NodeStateVariable(variable_store.Variable):
+
+    section = 'node'
+    option = 'state'
+    c = dict(parse=str)
+    dependencies = [
+        SimpleVariable,
+    ]
+
+    def compute(self):
+        return self.state[1]
+
+
+class BrokenVariable(variable_store.Variable):
+
+    section = 'broken'
+    option = 'variable'
+    dependencies = [
+        SimpleVariable,
+    ]
+
+    def compute(self):
+        return 1 / 0
+
+
+class StateVariableStore(variable_store.VariableStore):
+
+    variableClasses = [
+        SimpleVariable,
+        NodeStateVariable,
+        BrokenVariable,
+    ]
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+'Compare the per-node cost of resolving variables with recursive dependency walks and with precomputed closures'
+# Import system modules
+import time
+import optparse
+# Import custom modules
+import script_process
+from np.lib import metric, variable_store
+
+
+def makeRecursiveVariableStore(metricModel):
+    'Return a VariableStore subclass that walks dependencies recursively on each cache miss'
+
+    class RecursiveVariableStore(metricModel.VariableStore):
+
+        def getVariable(self, variableClass):
+            # If the variable is in the cache,
+            if variableClass in self.variableByClass:
+                return self.variableByClass[variableClass]
+            # If the variable has dependencies and any of the variable's dependencies are in the cache,
+            if variableClass.dependencies and self.hasRecursively(variableClass.dependencies):
+                variable = variableClass(self)
+            # If a parent is defined,
+            elif self.variableStore:
+                variable = self.variableStore.getVariable(variableClass)
+            else:
+                raise variable_store.VariableError('Unable to get ' + variableClass.__name__)
+            # Store the variable in the cache
+            self.variableByClass[variableClass] = variable
+            return variable
+
+        def hasRecursively(self, variableClasses):
+            for variableClass in variableClasses:
+                if variableClass in self.variableByClass or (variableClass.dependencies and self.hasRecursively(variableClass.dependencies)):
+                    return True
+            return False
+
+    return RecursiveVariableStore
+
+
+def measure(variableStoreClass, metricModel, nodeCount):
+    'Return seconds per node and the metrics for nodes of increasing population'
+    # Load job-level configuration
+    jobVS = variableStoreClass()
+    metrics = []
+    # Evaluate
+    startTimeInSeconds = time.time()
+    for nodeIndex in xrange(nodeCount):
+        nodeVS = variableStoreClass({'demographics': {'population count': str(10 * nodeIndex)}}, jobVS)
+        metrics.append(nodeVS.get(metricModel.Metric))
+        nodeVS.getValueByOptionBySection()
+    # Return
+    return (time.time() - startTimeInSeconds) / nodeCount, metrics
+
+
+# If we are running the script from the command-line,
+if __name__ == '__main__':
+    # Parse options
+    optionParser = optparse.OptionParser()
+    optionParser.add_option('-n', '--nodeCount', dest='nodeCount', type='int', default=1000, help='number of nodes to evaluate')
+    options, arguments = optionParser.parse_args()
+    # For each metric model,
+    for metricModelName in metric.getModelNames():
+        metricModel = metric.getModel(metricModelName)
+        recursiveTime, recursiveMetrics = measure(makeRecursiveVariableStore(metricModel), metricModel, options.nodeCount)
+        closureTime, closureMetrics = measure(metricModel.VariableStore, metricModel, options.nodeCount)
+        # Make sure that both approaches agree
+        assert recursiveMetrics == closureMetrics
+        print '%s: recursive %.3f ms/node, closure %.3f ms/node, speedup %.2fx' % (metricModelName, recursiveTime * 1000, closureTime * 1000, recursiveTime / closureTime)
@@ -15,6 +15,7 @@ def connect():
     import sqlalchemy as sa
     # Import custom modules
     from np import model
+    from np.lib import dataset_store, curve
     # Parse options and arguments
     optionParser = optparse.OptionParser()
     optionParser.add_option('-c', '--configurationPath', dest='configurationPath', 
@@ -26,6 +27,9 @@ def connect():
     configuration.read(options.configurationPath)
     # Initialize model
     model.init_model(sa.create_engine(configuration.get('app:main', 'sqlalchemy.url')))
+    # Configure dataset engines
+    dataset_store.configure(dict(configuration.items('app:main')))
+    curve.configure(dict(configuration.items('app:main')))
     # Return
     return configuration
 